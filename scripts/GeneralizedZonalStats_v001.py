@@ -14,10 +14,67 @@
 
 # Import modules
 import os
+import re
+import glob
+import json
+import math
+import numbers
+import shutil
+import sqlite3
+import time
+import tempfile
+import subprocess
+import multiprocessing
+from functools import partial
+from collections import Counter
 import grass.script as grass
 import grass.script.vector as v
 import grass.script.raster as r
 import grass.script.db as db
+import grass.script.array as garray
+from grass.pygrass.raster import RasterRow
+from grass.pygrass.gis.region import Region
+from grass.pygrass.modules import Module, ParallelModuleQueue
+import numpy as np
+
+# numba is optional; if it is available, some array functions are compiled
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# rasterio is optional; it is only needed for run_zonal_stats_fast and open_rasterio
+try:
+    import rasterio
+    import rasterio.features
+    import rasterio.windows
+except ImportError:
+    rasterio = None
+
+# scipy is optional; it is only needed for run_zonal_stats_ndimage
+try:
+    from scipy import ndimage
+except ImportError:
+    ndimage = None
+
+# Types of columns accepted by create_new_column, and their SQL types
+COLUMN_TYPES = {'int': 'integer', 'float': 'double precision', 'string': 'varchar(20)'} # increase the varchar length if necessary
+
+# Largest range of patch ids counted with a bitset (one byte per possible id)
+MAX_BITSET_RANGE = 10**8
+
+# Largest range of patch ids counted with a bitset, relative to the number of cells read
+# (the bitset is allocated for each feature, so it should not be much larger than the feature itself)
+BITSET_RANGE_FACTOR = 8
+
+# Largest number of features updated by a single UPDATE ... CASE statement
+MAX_CASE_ROWS = 500
+
+# First column (zone) of each line of the output of r.stats
+_RSTATS_ZONE_RE = re.compile(r'^(\S+)\s', re.M)
+
+# Monotonic, high resolution clock for the timing of the steps of the zonal stats (time.time in Python 2)
+_timer = getattr(time, 'perf_counter', time.time)
 
 # Function proportion_habitat
 def proportion_habitat(input_rast):
@@ -25,110 +82,758 @@ def proportion_habitat(input_rast):
     input_rast must be a binary 1/0 map
     '''
         
-    # Count number of cells of each category with r.stats -c
-    cell_counts = grass.read_command('r.stats', flags = 'c', input = input_rast).split('\n')
-    # Take only values != ''
-    valid_cell_counts = [val for val in cell_counts if val != '']
+    # Read the raster within the current region and MASK as a numpy array (null cells are NaN),
+    # with no module call to be parsed
+    a = garray.array(input_rast, null = 'nan')
     
-    # Check values of raster
-    if len(valid_cell_counts) > 3:
-        # If len > 3 (it has more than 0, 1, and null *), return and error
-        grass.error('There is a problem with the input raster '+input_rast+'. Raster values must be either 0, 1, or null.')
+    return proportion_habitat_array(a, name = input_rast)
+
+# Function proportion_habitat_array
+def proportion_habitat_array(a, name = 'array'):
+    '''
+    a - numpy array with values of a binary 1/0 map, null cells as NaN
+    name - name of the input map, used in error messages
+    '''
     
-    # If it is ok, go on
+    # Number of non-null, zero, and one cells: if numba is available, counted in a single parallel pass;
+    # otherwise, counted directly over the array (no copies of the valid cells)
+    if numba is not None:
+        total, ones, zeros = _count_habitat_cells(np.asarray(a).ravel())
+        total, ones, zeros = int(total), int(ones), int(zeros)
     else:
-        # Zeros
-        zero_count_aux = valid_cell_counts[0].split(' ')
-        zero = zero_count_aux[0]
-        zero_count = zero_count_aux[1]
-        
-        # Ones
-        one_count_aux = valid_cell_counts[1].split(' ')
-        one = one_count_aux[0]
-        one_count = one_count_aux[1]
-        
-        # If len == 3, null may be also present
-        null = ''
-        if len(valid_cell_counts) == 3:
-            # Nulls
-            null_count_aux = valid_cell_counts[2].split(' ')
-            null = null_count_aux[0]
-            null_count = null_count_aux[1]
-            
-            # If the third value (besides 0 and 1) is not *, return error
-            if null != '*':
-                grass.error('There is a problem with the input raster '+input_rast+'. The value '+null+' should not be present in the raster.')
-            
-        # If zero is really zero, when 0 is present
-        if zero == '0':
-            # Number of zero cells
-            zero_count_float =  float(zero_count)
-        # When zero is absent (eg 100% habitat)
-        elif zero == '1':
-            # Number of one cells
-            zero_count_float = 0.0
-            one_count_float =  float(zero_count)
+        total = int(np.count_nonzero(~np.isnan(a)))
+        ones = int(np.count_nonzero(a == 1))
+        zeros = int(np.count_nonzero(a == 0))
+    
+    # Check values of raster
+    if ones + zeros != total:
+        # If there are values other than 0, 1, and null, return an error
+        grass.error('There is a problem with the input raster '+name+'. Raster values must be either 0, 1, or null.')
+        return
+    
+    try:
+        # Proportion of 1's
+        return 100.0*ones/total
+    except ZeroDivisionError:
+        grass.error('There is a problem with the input raster '+name+'. There are only null cells in this region of the map.')
+
+# Function _count_habitat_cells - count non-null, one, and zero cells of an array
+if numba is not None:
+    @numba.njit(parallel = True, cache = True)
+    def _count_habitat_cells(values):
+        '''
+        Function _count_habitat_cells
+        
+        This function counts the non-null (not NaN), one, and zero values of a 1-dimensional array in a 
+        single pass over the array, split among threads, without temporary boolean arrays. It is only 
+        defined if numba is available.
+        '''
+        
+        total = 0
+        ones = 0
+        zeros = 0
+        for i in numba.prange(values.size):
+            val = values[i]
+            if not np.isnan(val):
+                total += 1
+                if val == 1:
+                    ones += 1
+                elif val == 0:
+                    zeros += 1
+        
+        return total, ones, zeros
+
+# Function proportion_habitat_stack
+def proportion_habitat_stack(input_rasters):
+    '''
+    input_rasters - list of binary 1/0 maps (e.g. the same habitat in several years)
+    
+    Returns the list of proportions of habitat of each map, computed over a single stack of their arrays
+    within the current region and MASK. Maps with values other than 0, 1, and null get None.
+    '''
+    
+    # Read each map once and stack them (rows x columns x maps; null cells are NaN)
+    a = _read_stack(input_rasters)
+    
+    # Number of non-null, zero, and one cells of each map
+    total = np.count_nonzero(~np.isnan(a), axis = (0, 1))
+    ones = np.count_nonzero(a == 1, axis = (0, 1))
+    zeros = np.count_nonzero(a == 0, axis = (0, 1))
+    
+    props = []
+    for i in range(len(input_rasters)):
+        if ones[i] + zeros[i] != total[i]:
+            grass.error('There is a problem with the input raster '+input_rasters[i]+'. Raster values must be either 0, 1, or null.')
+            props.append(None)
+        elif total[i] == 0:
+            grass.error('There is a problem with the input raster '+input_rasters[i]+'. There are only null cells in this region of the map.')
+            props.append(None)
         else:
-            raise Exception('Error in raster cell values n.1.')
-         
-        # If one is really one, when 1 is present   
-        if one == '1':
-            # Number of one cells
-            one_count_float =  float(one_count)
-        # If 1 is absent (eg there is not habitat)
-        elif one == '*' and zero == '0':
-            one_count_float = 0.0
-        
-        # If there are null cells, warn the user
-        if one == '*' or null == '*':
-            if one == '*':
-                null_count = one_count
-            #grass.warning('There are '+null_count+' null values in this region of the map.')
-            # here we should warn about the number of null cells within the mask, but it seems the values outside the mask are being considered too. Find out what to do later.
-        
-        try: 
-            # Proportion of 1's
-            proportion_1 = one_count_float/(one_count_float + zero_count_float)
-            
-            return(100*proportion_1)
-        except:
-            #raise Exception('Error in raster cell values n.2.')
-            grass.error('There is a problem with the input raster '+input_rast+'. It presents the values '+zero+' and '+one+', but should present only 0 and 1.')
+            props.append(100.0*int(ones[i])/int(total[i]))
+    
+    return props
+
+# Functions with multi_raster = True receive the list of all input rasters in run_zonal_stats
+proportion_habitat_stack.multi_raster = True
 
+# Function proportion_habitat_multi
+def proportion_habitat_multi(input_rasters):
+    '''
+    input_rasters - list of binary 1/0 maps (e.g. the same habitat in several years)
+    
+    Returns the list of proportions of habitat of each map, within the current region and MASK. The same
+    as proportion_habitat_stack, but each map is read and counted in turn, so only one array is kept in 
+    memory at a time (instead of the whole stack).
+    '''
+    
+    return [proportion_habitat_array(garray.array(rast, null = 'nan'), name = rast) for rast in input_rasters]
+
+proportion_habitat_multi.multi_raster = True
+
+# Function number_patches_stack
+def number_patches_stack(input_rasters_pid):
+    '''
+    input_rasters_pid - list of patch id maps (e.g. the same habitat in several years)
+    
+    Returns the list of numbers of patches of each map, computed over a single stack of their arrays
+    within the current region and MASK.
+    '''
+    
+    # Read each map once and stack them (rows x columns x maps; null cells are NaN)
+    a = _read_stack(input_rasters_pid)
+    
+    return [number_patches_array(a[:, :, i]) for i in range(a.shape[2])]
+
+number_patches_stack.multi_raster = True
+
+# Function _read_stack - read several rasters as a single 3-dimensional array
+def _read_stack(input_rasters):
+    '''
+    Function _read_stack
+    
+    This function reads each raster once, within the current region and MASK, and stacks them as a 
+    single array (rows x columns x rasters), with null cells as NaN.
+    '''
+    
+    return np.stack([np.asarray(garray.array(rast, null = 'nan')) for rast in input_rasters], axis = -1)
 
 # Function number_patches
-def number_patches(input_raster_pid, mask = False):
+def number_patches(input_raster_pid):
+    '''
+    input_raster_pid - patch id map; the current region and MASK are respected, so no copy of the map is needed
+    '''
+    
+    # Read the Patch ID input map within the current region and MASK as a numpy array (null cells, 
+    # including those outside the MASK, are NaN)
+    a = garray.array(input_raster_pid, null = 'nan')
+    
+    # Return NP
+    return number_patches_array(a)
+
+# Function number_patches_array
+def number_patches_array(a):
+    '''
+    a - numpy array with values of a patch id map, null cells as NaN
+    '''
+    
+    # Non-null pid values
+    valid = a[~np.isnan(a)]
+    if valid.size == 0:
+        return 0
+    
+    # If numba is available, count the pids in a single pass, without sorting: if the range of pid values is
+    # not too large, both in absolute terms and relative to the number of cells, mark each pid in a bitset;
+    # otherwise (sparse pids, e.g. a small feature over a map with many patches), insert them in a hash set
+    if numba is not None:
+        min_pid = int(valid.min())
+        max_pid = int(valid.max())
+        pid_range = max_pid - min_pid
+        if pid_range < MAX_BITSET_RANGE and pid_range <= BITSET_RANGE_FACTOR*valid.size:
+            return int(_count_unique_bitset(valid, min_pid, max_pid))
+        else:
+            return int(_count_unique_set(valid))
+    
+    # Otherwise, NP = number of unique non-null pid values
+    return int(np.unique(valid).size)
+
+# Function _count_unique_bitset - count unique integer values within a known range
+def _count_unique_bitset(values, min_val, max_val):
+    '''
+    Function _count_unique_bitset
+    
+    This function counts the unique integer values of a 1-dimensional array, all of them between
+    min_val and max_val, marking each one in a bitset. It runs in a single pass, without sorting, and is 
+    compiled with numba when it is available.
     '''
-    input_raster_pid - patch id map
-    mask - raster used as mask
+    
+    seen = np.zeros(max_val - min_val + 1, dtype = np.bool_)
+    count = 0
+    for i in range(values.size):
+        pos = int(values[i]) - min_val
+        if not seen[pos]:
+            seen[pos] = True
+            count += 1
+    
+    return count
+
+if numba is not None:
+    _count_unique_bitset = numba.njit(cache = True)(_count_unique_bitset)
+
+# Function _count_unique_set - count unique integer values within any range
+if numba is not None:
+    @numba.njit(cache = True)
+    def _count_unique_set(values):
+        '''
+        Function _count_unique_set
+        
+        This function counts the unique integer values of a 1-dimensional array, inserting each one in a 
+        set, in a single pass and without sorting. Memory depends only on the number of unique values, so
+        it is used when the range of values is too large for a bitset. It is only defined if numba is available.
+        '''
+        
+        seen = set()
+        for i in range(values.size):
+            seen.add(np.int64(values[i]))
+        
+        return len(seen)
+
+# Function _zonal_sums_counts - sums and counts of values for each zone
+def _zonal_sums_counts(zones, values, n_zones):
+    '''
+    Function _zonal_sums_counts
+    
+    This function calculates the sum and the number of non-null values of each zone, for zones
+    numbered from 0 to n_zones - 1 (null cells, in zones or values, as NaN). If numba is available, the
+    cells are split among threads, each one accumulating in its own buckets, which are added in the end;
+    otherwise np.bincount is used.
+    
+    Returns
+    -------
+    sums, counts: numpy arrays
+        Arrays of length n_zones with the sum and the number of values of each zone.
+    '''
+    
+    if numba is not None:
+        zones = np.ascontiguousarray(zones, dtype = np.float64).ravel()
+        values = np.ascontiguousarray(values, dtype = np.float64).ravel()
+        local_sums, local_counts = _zonal_sums_counts_threads(zones, values, n_zones, numba.get_num_threads())
+        return local_sums.sum(axis = 0), local_counts.sum(axis = 0)
+    
+    valid = ~np.isnan(zones) & ~np.isnan(values)
+    zone_ids = zones[valid].astype(np.int64)
+    counts = np.bincount(zone_ids, minlength = n_zones)[:n_zones]
+    sums = np.bincount(zone_ids, weights = values[valid], minlength = n_zones)[:n_zones]
+    
+    return sums, counts
+
+# Function _zonal_sums_counts_threads - sums and counts of each zone, in local buckets for each thread
+if numba is not None:
+    @numba.njit(parallel = True, cache = True)
+    def _zonal_sums_counts_threads(zones, values, n_zones, n_threads):
+        local_sums = np.zeros((n_threads, n_zones))
+        local_counts = np.zeros((n_threads, n_zones))
+        chunk = (zones.size + n_threads - 1)//n_threads
+        for t in numba.prange(n_threads):
+            for i in range(t*chunk, min(zones.size, (t + 1)*chunk)):
+                if not (np.isnan(zones[i]) or np.isnan(values[i])):
+                    zone = int(zones[i])
+                    if zone >= 0 and zone < n_zones:
+                        local_sums[t, zone] += values[i]
+                        local_counts[t, zone] += 1
+        return local_sums, local_counts
+
+# Function _zonal_module - GRASS module computing the statistics of a raster for all zones at once
+def _zonal_module(zones_rast, input_rast, method):
+    '''
+    Function _zonal_module
+    
+    This function prepares (but does not run) the GRASS module that computes one statistic of a raster
+    for all zones at once, within the current region: r.stats -n, listing the unique (zone, pid) pairs, 
+    for method 'np'; r.univar -t with the raster of zones for the other methods. The output is kept, to be 
+    parsed by _parse_zonal_stats.
+    
+    Parameters
+    ----------
+    zones_rast: string
+        Name of the raster of zones (features rasterized with their cats).
+    input_rast: string
+        Name of the input raster.
+    method: string; {'np', 'sum', 'count', 'mean', 'min', 'max', 'proportion'}
+        Statistic to be computed.
+        
+    Returns
+    -------
+    module: pygrass Module
+        Module ready to be run (e.g. within a ParallelModuleQueue).
     '''
     
-    if mask:
-        temp_map_name = 'pid_mask'
-        grass.mapcalc(temp_map_name+' = '+input_raster_pid)
+    if method == 'np':
+        return Module('r.stats', flags = 'n', input = [zones_rast, input_rast], stdout_ = subprocess.PIPE, run_ = False, quiet = True)
     else:
-        temp_map_name = input_raster_pid
+        return Module('r.univar', flags = 't', map = input_rast, zones = zones_rast, separator = 'pipe', 
+                      stdout_ = subprocess.PIPE, run_ = False, quiet = True)
+
+# Function _parse_zonal_stats - statistics for all zones, from the output of _zonal_module
+def _parse_zonal_stats(output, method):
+    '''
+    Function _parse_zonal_stats
+    
+    This function parses the output of the module prepared by _zonal_module. For method 'np', the zones
+    are taken from the output of r.stats in a single scan with a precompiled regular expression and the
+    patch ids within each zone are counted. For the other methods, the statistic is read from the table
+    of r.univar ('proportion' is the mean multiplied by 100).
     
-    # Assess the number of categories (patch IDs) in the Patch ID input map
-    maps_vals_aux = grass.read_command('r.category', map = temp_map_name).split('\n')
-    # Remove absent values ''
-    map_vals = [val for val in maps_vals_aux if val != '']
+    Returns
+    -------
+    stats: dictionary
+        Dictionary with zones (cats, in character form) as keys and the statistic as values. Zones with
+        only null cells are not included.
+    '''
     
-    # NP = length of the list of pid values
-    number_of_patches = len(map_vals)
+    if method == 'np':
+        return dict(Counter(_RSTATS_ZONE_RE.findall(output)))
     
-    # Delete pid map for the mask region, if applicable
-    if mask:
-        grass.run_command('g.remove', type = 'raster', pattern = temp_map_name, flags = 'f')
+    output = output.splitlines()
+    header = output[0].split('|')
     
-    # Return NP
-    return number_of_patches
+    stats = {}
+    for line in output[1:]:
+        if line == '':
+            continue
+        row = dict(zip(header, line.split('|')))
+        
+        n = int(row['non_null_cells'])
+        if n == 0:
+            continue
+        
+        if method == 'count':
+            stats[row['zone']] = n
+        elif method == 'proportion':
+            stats[row['zone']] = 100.0*float(row['mean'])
+        else:
+            stats[row['zone']] = float(row[method])
+    
+    return stats
+
+# Function _sql_value - format a value to be written with SQL
+def _sql_value(val):
+    '''
+    Function _sql_value
+    
+    This function formats a value returned by a zonal statistics function to be used in a SQL 
+    statement: None and NaN become NULL, numbers are kept as they are, and strings are quoted.
+    '''
+    
+    if val is None or val != val:
+        return 'NULL'
+    elif isinstance(val, numbers.Integral):
+        return str(int(val))
+    elif isinstance(val, numbers.Real):
+        return repr(float(val))
+    else:
+        return "'"+str(val).replace("'", "''")+"'"
+
+# Function _sql_param - convert a value to be written as a SQL parameter
+def _sql_param(val):
+    '''
+    Function _sql_param
+    
+    This function converts a value returned by a zonal statistics function to a Python type accepted
+    by sqlite3 as a parameter: None and NaN become None (NULL), numpy numbers become int or float.
+    '''
+    
+    if val is None or val != val:
+        return None
+    elif isinstance(val, numbers.Integral):
+        return int(val)
+    elif isinstance(val, numbers.Real):
+        return float(val)
+    else:
+        return str(val)
+
+# Function _vector_extents - get the bounding boxes of all features of a vector at once
+def _vector_extents(input_shape):
+    '''
+    Function _vector_extents
+    
+    This function returns the bounding box of each feature (cat) of a vector, computed by a single
+    v.to.db -p (print only, the attribute table is not changed) call.
+    
+    Returns
+    -------
+    extents: dictionary
+        Dictionary with cats (in character form) as keys and tuples (n, s, e, w) as values.
+    '''
+    
+    output = grass.read_command('v.to.db', flags = 'p', map = input_shape, option = 'bbox', columns = 'n,s,e,w', 
+                                separator = 'pipe', quiet = True).splitlines()
+    
+    extents = {}
+    for line in output:
+        row = line.split('|')
+        # Skip header and empty lines
+        if len(row) != 5 or not row[0].isdigit():
+            continue
+        extents[row[0]] = tuple([float(val) for val in row[1:]])
+    
+    return extents
+
+# Function _sort_cats_spatially - sort features along a Z-order (Morton) curve
+def _sort_cats_spatially(cats, extents, bits = 16):
+    '''
+    Function _sort_cats_spatially
+    
+    This function sorts the cats of the features by the Z-order (Morton) key of the centroid of their
+    bounding boxes, so that features close in space are processed one after the other (and sent together
+    to the same worker), and the same blocks of the rasters are read again while they are still cached.
+    
+    Parameters
+    ----------
+    cats: list with integers in character form ('1' and not 1)
+        Cats of the features to be sorted.
+    extents: dictionary
+        Bounding boxes (n, s, e, w) of the features, with cats as keys.
+    bits: integer
+        Number of bits of each coordinate of the centroids in the Z-order key.
+        
+    Returns
+    -------
+    cats: list with integers in character form
+        Cats sorted along the Z-order curve.
+    '''
+    
+    if len(cats) < 2:
+        return list(cats)
+    
+    # Centroids of the features
+    x = np.array([(extents[cat][2] + extents[cat][3])/2.0 for cat in cats])
+    y = np.array([(extents[cat][0] + extents[cat][1])/2.0 for cat in cats])
+    
+    # Centroids as integer coordinates within [0, 2^bits)
+    size = 2**bits - 1
+    xi = ((x - x.min()) / max(x.max() - x.min(), 1e-12) * size).astype(np.uint64)
+    yi = ((y - y.min()) / max(y.max() - y.min(), 1e-12) * size).astype(np.uint64)
+    
+    # Interleave the bits of x and y
+    key = np.zeros(len(cats), dtype = np.uint64)
+    for b in range(bits):
+        key |= ((xi >> np.uint64(b)) & np.uint64(1)) << np.uint64(2*b)
+        key |= ((yi >> np.uint64(b)) & np.uint64(1)) << np.uint64(2*b + 1)
+    
+    return [cats[i] for i in np.argsort(key, kind = 'mergesort')]
+
+# Function _align_bbox - align a bounding box to a raster grid
+def _align_bbox(n, s, e, w, grid):
+    '''
+    Function _align_bbox
+    
+    This function expands a bounding box so that its limits fall on the cell edges of a raster grid,
+    as g.region align = raster does, but without reading the raster header again.
+    
+    Parameters
+    ----------
+    n, s, e, w: float
+        Limits of the bounding box.
+    grid: dictionary
+        Dictionary with the 'north', 'west', 'nsres', and 'ewres' of the raster grid.
+        
+    Returns
+    -------
+    n, s, e, w: float
+        Limits of the aligned bounding box.
+    '''
+    
+    # Number of rows/columns from the grid origin, rounded to avoid floating point noise
+    row_n = math.floor(round((grid['north'] - n)/grid['nsres'], 6))
+    row_s = math.ceil(round((grid['north'] - s)/grid['nsres'], 6))
+    col_w = math.floor(round((w - grid['west'])/grid['ewres'], 6))
+    col_e = math.ceil(round((e - grid['west'])/grid['ewres'], 6))
+    
+    return (grid['north'] - row_n*grid['nsres'], grid['north'] - row_s*grid['nsres'],
+            grid['west'] + col_e*grid['ewres'], grid['west'] + col_w*grid['ewres'])
+
+# Function _bbox_window - rows and columns of a bounding box within a raster grid
+def _bbox_window(bbox, grid):
+    '''
+    Function _bbox_window
+    
+    This function returns the rows and columns of a grid (e.g. an array read over a region) covered by a 
+    bounding box, after aligning it to the grid, clipped to the limits of the grid.
+    
+    Parameters
+    ----------
+    bbox: tuple
+        Bounding box (n, s, e, w).
+    grid: dictionary
+        Dictionary with the 'north', 'west', 'nsres', 'ewres', 'rows', and 'cols' of the grid.
+        
+    Returns
+    -------
+    rows, cols: slices
+        Rows and columns of the grid within the bounding box.
+    '''
+    
+    n, s, e, w = _align_bbox(bbox[0], bbox[1], bbox[2], bbox[3], grid)
+    row_n = max(0, int(round((grid['north'] - n)/grid['nsres'])))
+    row_s = min(grid['rows'], int(round((grid['north'] - s)/grid['nsres'])))
+    col_w = max(0, int(round((w - grid['west'])/grid['ewres'])))
+    col_e = min(grid['cols'], int(round((e - grid['west'])/grid['ewres'])))
+    
+    return slice(row_n, row_s), slice(col_w, col_e)
+
+# Function _set_region - set the computational region of the current process, without calling g.region
+def _set_region(n, s, e, w, grid):
+    '''
+    Function _set_region
+    
+    This function sets the computational region through the GRASS_REGION environment variable, which
+    GRASS modules started by this process use instead of the region of the mapset (WIND file). It avoids
+    launching g.region for each feature or tile, and does not change the region of the mapset. The 
+    variable must be removed (_reset_region) once the processing is done.
+    
+    Parameters
+    ----------
+    n, s, e, w: float
+        Limits of the region, already aligned to the grid.
+    grid: dictionary
+        Dictionary with the 'proj', 'zone', 'nsres', and 'ewres' of the grid.
+        
+    Returns
+    -------
+    None.
+    '''
+    
+    rows = int(round((n - s)/grid['nsres']))
+    cols = int(round((e - w)/grid['ewres']))
+    
+    # Same fields of the WIND file, separated by ;
+    region = [('proj', grid['proj']), ('zone', grid['zone']), ('north', n), ('south', s), ('east', e), ('west', w),
+              ('cols', cols), ('rows', rows), ('e-w resol', grid['ewres']), ('n-s resol', grid['nsres']),
+              ('top', 1), ('bottom', 0), ('cols3', cols), ('rows3', rows), ('depths', 1),
+              ('e-w resol3', grid['ewres']), ('n-s resol3', grid['nsres']), ('t-b resol', 1)]
+    os.environ['GRASS_REGION'] = ';'.join([key+': '+repr(val) for key, val in region])+';'
+
+# Function _reset_region - go back to the computational region of the mapset
+def _reset_region():
+    '''
+    Function _reset_region
+    
+    This function removes the GRASS_REGION environment variable set by _set_region.
+    '''
+    
+    os.environ.pop('GRASS_REGION', None)
+
+# Function _init_worker - give each worker process its own GRASS mapset
+def _init_worker(mapset, worker_prefix, gisrc_dir):
+    '''
+    Function _init_worker
+
+    This function is run once by each process of the pool of workers. It creates a new mapset for the
+    worker and a copy of the GRASS session file (GISRC) pointing to it, so that the computational region
+    and the MASK of each worker do not collide with the ones of the other workers. The input mapset is
+    kept in the search path of the new mapset, so the input maps remain accessible. If numba is available,
+    its parallel kernels are limited to a single thread within each worker.
+
+    Parameters
+    ----------
+    mapset: string
+        Name of the mapset where the input maps are located.
+    worker_prefix: string
+        Prefix of the name of the mapsets of the workers.
+    gisrc_dir: string
+        Path of the folder where the session files of the workers are written.
+
+    Returns
+    -------
+    None.
+    '''
+
+    # GRASS environment of the parent process
+    env = grass.gisenv()
+    location_path = os.path.join(env['GISDBASE'], env['LOCATION_NAME'])
+
+    # Create the mapset of the worker, with the default region of the location
+    worker_mapset = worker_prefix+'_'+str(os.getpid())
+    worker_path = os.path.join(location_path, worker_mapset)
+    os.mkdir(worker_path)
+    shutil.copyfile(os.path.join(location_path, 'PERMANENT', 'DEFAULT_WIND'), os.path.join(worker_path, 'WIND'))
+
+    # Search path of the worker mapset
+    search_path = [worker_mapset, mapset]
+    if mapset != 'PERMANENT':
+        search_path.append('PERMANENT')
+    with open(os.path.join(worker_path, 'SEARCH_PATH'), 'w') as f:
+        f.write('\n'.join(search_path)+'\n')
+
+    # Session file of the worker, pointing to its own mapset
+    worker_gisrc = os.path.join(gisrc_dir, 'gisrc_'+str(os.getpid()))
+    with open(os.environ['GISRC']) as f:
+        gisrc_lines = [line for line in f if not line.startswith('MAPSET:')]
+    with open(worker_gisrc, 'w') as f:
+        f.writelines(gisrc_lines)
+        f.write('MAPSET: '+worker_mapset+'\n')
+    os.environ['GISRC'] = worker_gisrc
+
+    # The workers already run in parallel, so the parallel numba kernels use a single thread in each of
+    # them (otherwise each worker would start one thread per core, oversubscribing the CPUs)
+    if numba is not None:
+        numba.set_num_threads(1)
+
+# Function _process_feature - run a function for each raster, within a feature/polygon
+def _process_feature(cat, extents, input_rasters, column_names, function, args, kwargs, mapset, grid, zones_rast):
+    '''
+    Function _process_feature
+
+    This function sets the region and the MASK to a single feature of the input vector and runs the
+    function passed as argument for each of the input rasters (or once for all of them, for functions
+    with the attribute multi_raster = True, e.g. proportion_habitat_stack). It may be run both in the current mapset
+    or within the mapset of a worker process (see _init_worker). The MASK is taken from the raster of 
+    zones (all features rasterized with their cats), with r.mask maskcats=cat, and is replaced from one
+    feature to the next; the MASK of the last feature must be removed once all features are processed.
+
+    Parameters
+    ----------
+    cat: string
+        Cat of the feature/polygon to be processed.
+    extents: dictionary
+        Bounding boxes (n, s, e, w) of the features of the input vector, with cats as keys.
+    input_rasters: list with strings
+        List with the names of the input rasters.
+    column_names: list with strings
+        List with the names of the columns, in the same order as the input rasters.
+    function: Python function
+        Function to be used to calculate over the feature. It must be defined at the module level,
+        so that it may be sent to the worker processes.
+    args: tuple
+        Arguments of the function, not named.
+    kwargs: dictionary
+        Optional arguments of the function, named.
+    mapset: string
+        Name of the mapset where the input maps are located.
+    grid: dictionary
+        Grid of the first input raster (north, west, nsres, ewres), used to align the region.
+    zones_rast: string
+        Name of the raster with all the features of the input vector, with their cats as values.
+
+    Returns
+    -------
+    results: list with tuples
+        List of (cat, column, value) tuples, one for each input raster.
+    times: dictionary
+        Time (seconds) spent in each step for this feature: 'region', 'mask', and 'compute'.
+    '''
+
+    times = {}
+    start = _timer()
+
+    # Fully qualified names of the input maps, since they may be in another mapset
+    input_rasters = [rast if '@' in rast else rast+'@'+mapset for rast in input_rasters]
+    zones_rast = zones_rast if '@' in zones_rast else zones_rast+'@'+mapset
+
+    # Set region to the feature extent, aligned to the raster grid
+    # (the raster of zones already has the feature rasterized, so there is no need to rasterize it again)
+    n, s, e, w = extents[cat]
+    n, s, e, w = _align_bbox(n, s, e, w, grid)
+    _set_region(n, s, e, w, grid)
+    times['region'] = _timer() - start
+
+    # Set the MASK for the feature from the raster of zones, selecting the cat of the feature
+    # (r.mask raster= maskcats= reclassifies the zones and reads no cells, so it does not depend on
+    # the MASK of the previous feature, which is replaced)
+    start = _timer()
+    grass.run_command('r.mask', raster = zones_rast, maskcats = cat, overwrite = True, quiet = True)
+    times['mask'] = _timer() - start
+    start = _timer()
+
+    # Functions over several rasters (multi_raster = True) are run once, for all rasters/columns
+    if getattr(function, 'multi_raster', False):
+        vals = function(input_rasters, *args, **kwargs)
+        results = [(cat, column_names[i], vals[i]) for i in range(len(input_rasters))]
+    
+    # Otherwise, for each raster/column
+    else:
+        results = []
+        for i in range(len(input_rasters)):
+
+            # Column and raster
+            col = column_names[i]
+            rast = input_rasters[i]
+
+            # Run function
+            val = function(rast, *args, **kwargs)
+
+            # Keep the value, to be written in the input shape attribute table later
+            results.append((cat, col, val))
     
+    times['compute'] = _timer() - start
+
+    # Message - cat ok
+    grass.message("Feature "+str(cat)+' processed with success!')
+
+    return results, times
+
+# Function _process_feature_array - run a function on the arrays of all rasters, within a feature/polygon
+def _process_feature_array(cat, extents, input_rasters, column_names, function, args, kwargs, mapset, grid, zones_rast):
+    '''
+    Function _process_feature_array
+
+    This function sets the region to a single feature of the input vector, reads the raster of zones and 
+    all the input rasters once as numpy arrays, and runs the function passed as argument on the values
+    of each raster within the feature. No MASK is used: cells of the feature are selected by comparing
+    the raster of zones to the feature cat.
+
+    Parameters
+    ----------
+    The same as _process_feature. Here the function receives a 1-dimensional numpy array with the values
+    of the raster within the feature (null cells as NaN), instead of the raster name. The function may also
+    be a list of functions, one for each raster/column; rasters repeated in input_rasters are read only once.
+
+    Returns
+    -------
+    results: list with tuples
+        List of (cat, column, value) tuples, one for each input raster.
+    '''
+
+    # Fully qualified names of the input maps, since they may be in another mapset
+    input_rasters = [rast if '@' in rast else rast+'@'+mapset for rast in input_rasters]
+    zones_rast = zones_rast if '@' in zones_rast else zones_rast+'@'+mapset
+
+    # Set region to the feature extent, aligned to the raster grid
+    n, s, e, w = extents[cat]
+    n, s, e, w = _align_bbox(n, s, e, w, grid)
+    _set_region(n, s, e, w, grid)
+
+    # Cells of the feature
+    in_feature = np.asarray(garray.array(zones_rast, null = 'nan')) == int(cat)
+
+    # Read all rasters once, within the region of the feature
+    arrays = dict((rast, garray.array(rast, null = 'nan')) for rast in input_rasters)
+
+    # For each raster/column
+    results = []
+    for i in range(len(input_rasters)):
+
+        # Column, raster, and function
+        col = column_names[i]
+        rast = input_rasters[i]
+        func = function[i] if isinstance(function, list) else function
+
+        # Run function over the values within the feature
+        val = func(arrays[rast][in_feature], *args, **kwargs)
+
+        # Keep the value, to be written in the input shape attribute table later
+        results.append((cat, col, val))
+
+    # Message - cat ok
+    grass.message("Feature "+str(cat)+' processed with success!')
+
+    return results
+
 # Class generalized_zonal_stats
 class GeneralizedZonalStats():
     
     # Function init - load shape and raster maps
-    def __init__(self, input_shape, overwrite_shape = False, input_rasters = [], overwrite_rasters = False, folder = ''):
+    def __init__(self, input_shape, overwrite_shape = False, input_rasters = [], overwrite_rasters = False, folder = '', overwrite_columns = False, n_workers = None, max_batch_size = None, use_rasterio = False, zone_raster = None):
         '''
         Function init
         
@@ -154,6 +859,24 @@ class GeneralizedZonalStats():
             (the map is re-imported) or not (the same map is kept).
         folder: string
             Path of the folder where the maps are located.
+        overwrite_columns: bool (True/False)
+            If the columns to be created by create_new_column already exist in the attribute table of the
+            input vector, this variable states whether their values should be overwritten (True) or the 
+            process should be stopped (False). It may be changed for each call of create_new_column.
+        n_workers: int or None
+            Number of worker processes used to process the features in parallel. Each worker runs within
+            its own temporary mapset. If None (default), the number of CPUs is used. If 1, features are
+            processed serially, within the current mapset.
+        max_batch_size: int or None
+            Number of features sent at once to each worker, when features are processed in parallel.
+            If None (default), batches are sized so that each worker gets about four of them.
+        use_rasterio: bool (True/False)
+            If True, the input rasters are exported once and opened with rasterio right away, and kept open
+            to be read by run_zonal_stats_fast (see open_rasterio). It requires rasterio.
+        zone_raster: string or None
+            Name of a raster of zones already created from the input vector (v.to.rast use=cat, aligned to
+            the input rasters), to be reused by all runs instead of rasterizing the vector again each time. 
+            It is never removed. If None (default), the vector is rasterized in each run, to a temporary raster.
             
         Returns
         -------
@@ -171,28 +894,46 @@ class GeneralizedZonalStats():
         self.input_shape = input_shape
         self.input_rasters = input_rasters
         
+        # Whether to overwrite existing columns
+        self.overwrite_columns = overwrite_columns
+        
+        # Stack of rasters read to memory, and bit-packed masks of the features within it (see prefetch)
+        self.raster_stack = None
+        self._mask_cache = {}
+        
+        # Raster of zones provided by the user (see _rasterize_zones)
+        self.zone_raster = zone_raster
+        
+        # Rasters opened with rasterio, and buffer for their windows (see open_rasterio)
+        self._rio = None
+        self._rio_dir = None
+        self._scratch = None
+        
+        # Number of parallel workers
+        self.n_workers = n_workers if n_workers else multiprocessing.cpu_count()
+        self.max_batch_size = max_batch_size
+        
         # List of maps to be used in zonal statistics
-        to_be_used = 'Vector map to be used in zonal statistics:\n'
+        # (lines joined only when printed)
+        to_be_used = ['Vector map to be used in zonal statistics:']
         
         # Get current mapset
-        current_mapset = grass.read_command('g.mapset', flags = 'p').replace('\n','').replace('\r','')
+        current_mapset = grass.gisenv()['MAPSET']
+        self.mapset = current_mapset
         
-        # Get list of imported shape files
-        shape_list = grass.list_grouped('vector', pattern = input_shape) [current_mapset]
-        shape_exists = len(shape_list) # Length of the list
+        # Check if the shape file was already imported to the current mapset
+        shape_exists = grass.find_file(name = input_shape, element = 'vector', mapset = current_mapset)['name'] != ''
         
         # If the map does not exist within GRASS mapset or if the user wants to overwrite it, import it
         if (not shape_exists) or (overwrite_shape):
             
-            # Change to input folder
-            os.chdir(folder)
-            # Import shapefile
-            grass.run_command('v.in.ogr', input = input_shape+'.shp', output = input_shape, overwrite = True)
+            # Import shapefile from the input folder
+            grass.run_command('v.in.ogr', input = os.path.join(folder, input_shape+'.shp'), output = input_shape, overwrite = True)
             # Message to prompt
             grass.message('The vector map '+input_shape+' was successfully imported to GRASS GIS.')
 
             # Update list of maps to be used
-            to_be_used = to_be_used + input_shape+'\n\n'
+            to_be_used += [input_shape, '']
             
         else:
             # Message to prompt
@@ -201,48 +942,66 @@ class GeneralizedZonalStats():
             # If the shapefile already exists, it may be possible to just use it
             if shape_exists:
                 # Update list of maps to be used
-                to_be_used = to_be_used + input_shape+'\n\n'            
+                to_be_used += [input_shape, '']
             
         # Get list of imported raster maps
-        raster_list = grass.list_grouped('raster') [current_mapset]
+        # (as a set, for fast membership tests)
+        raster_set = set(grass.list_grouped('raster') [current_mapset])
         
         # Update list of maps to be used
-        to_be_used = to_be_used + 'Raster map(s) to be used in zonal statistics:\n'        
+        to_be_used.append('Raster map(s) to be used in zonal statistics:')
         
         # For each map in the input rasters
         for i in input_rasters:
             
             # If the map does not exist within GRASS or if the user wants to overwrite it, import it
-            if (not i in raster_list) or (overwrite_rasters):
+            if (i not in raster_set) or (overwrite_rasters):
                         
-                # Change to input folder
-                os.chdir(folder)
-                # Import raster
-                grass.run_command('r.in.gdal', input = i+'.tif', output = i, overwrite = True)
+                # Import raster from the input folder
+                grass.run_command('r.in.gdal', input = os.path.join(folder, i+'.tif'), output = i, overwrite = True)
                 # Message to prompt
                 grass.message('The raster map '+i+' was successfully imported to GRASS GIS.')                
                 
                 # Update list of maps to be used
-                to_be_used = to_be_used + i+'\n'
+                to_be_used.append(i)
                 
             else:
                 # Message to prompt
                 grass.warning('The raster map '+i+' was already present in the mapset and was not imported; if necessary, please check the overwrite option and retry.')
                 
                 # If the raster already exists, it may be possible to just use it
-                if i in raster_list:
+                if i in raster_set:
                     # Update list of maps to be used
-                    to_be_used = to_be_used + i+'\n'
+                    to_be_used.append(i)
                     
         # Print the name of the maps to be used
-        grass.message(to_be_used)
+        grass.message('\n'.join(to_be_used))
+        
+        # Grid of the first raster, used to align the region to each feature
+        if len(input_rasters) > 0:
+            rast_info = r.raster_info(input_rasters[0])
+            self.ewres = rast_info['ewres']
+            self.nsres = rast_info['nsres']
+            self.grid = {'north': rast_info['north'], 'west': rast_info['west'], 'nsres': self.nsres, 'ewres': self.ewres}
+            
+            # Projection and zone of the location, needed to set the region without g.region
+            region = grass.region()
+            self.grid['proj'] = region['projection']
+            self.grid['zone'] = region['zone']
+        
+        # Bounding boxes of all features, computed once and used to set the region of each feature
+        self.bboxes = _vector_extents(input_shape)
         
         # Ok, maps were imported or at least the the list of maps to be considered for zonal stats was loaded successfully
         self.load_ok = True
         
+        # Open the rasters with rasterio once, to be read by run_zonal_stats_fast
+        if use_rasterio:
+            self.open_rasterio()
+        
     
     # Function create_new_column - create new columns where zonal stats will be written
-    def create_new_column(self, column_names, type_col = ['int']):
+    def create_new_column(self, column_names, type_col = ['int'], overwrite_existing = None):
         '''
         Function create_new_column
         
@@ -261,6 +1020,11 @@ class GeneralizedZonalStats():
             column to be added - integer, float, string, or date.
             Each data type must be equivalent to one of the input raster maps, in the same order. Therefore,
             both lists must have the same number of elements.
+        overwrite_existing: bool (True/False) or None
+            If there are already columns with the same names in the attribute table of the input vector,
+            this variable states whether their values should be overwritten by the zonal statistics (True)
+            or the process should be stopped (False). If None (default), the overwrite_columns option
+            of the class is used.
             
         Returns
         -------
@@ -270,6 +1034,10 @@ class GeneralizedZonalStats():
         # Names of columns
         self.column_names = column_names
         
+        # Whether to overwrite existing columns
+        if overwrite_existing is None:
+            overwrite_existing = self.overwrite_columns
+        
         # Test if column name is greater than 10 characters and raise error if True
         # This is done to avoid errors with dbf while exporting the vector map as an ESRI shapefile later
         if any([len(i) > 10 for i in column_names]):
@@ -278,68 +1046,46 @@ class GeneralizedZonalStats():
         # If the length on column names and types is correct, go on
         if len(column_names) == len(self.input_rasters) and len(type_col) == len(self.input_rasters):
             
-            # Get list of existing cols in the attribute table of the input shapefile
-            existing_cols = v.vector_columns(self.input_shape, getDict = False)
+            # Get set of existing cols in the attribute table of the input shapefile
+            existing_cols = set(v.vector_columns(self.input_shape, getDict = False))
+            
+            # If some of the columns exist, check whether to overwrite them
+            to_overwrite = [col for col in column_names if col in existing_cols]
+            if len(to_overwrite) > 0 and not overwrite_existing:
+                raise ValueError('The column(s) '+', '.join(to_overwrite)+' already exist in the attribute table of the input shapefile. Please select other column names or set overwrite_existing = True and retry.')
+            
+            # Columns that do not exist yet are created
+            to_create = [(column_names[i], type_col[i]) for i in range(len(column_names)) if column_names[i] not in existing_cols]
+            
+            # Check variable types
+            for col, type_name in to_create:
+                if type_name not in COLUMN_TYPES:
+                    raise ValueError('Hey, the type of column '+col+' is neither int, float or string!')
             
             # Create string with col names and col types to be created
-            list_cols = ''
-            # String with col names to be shown in the end
-            list_cols_str = 'The following column(s) were created:\n'
-            # String with col names to be used:
-            list_cols_use = 'The following column(s) will be filled by zonal statistics:\n'
-            
-            # For each column, check if it does not exist already and increase the list
-            for i in range(len(column_names)):
-                
-                # Check if column exists
-                if column_names[i] in existing_cols:
-                    
-                    # If the column exists, check whether to overwrite it.
-                    overwrite = raw_input('The column '+column_names[i]+' already exists in the attribute table of the input shapefile. Should we overwrite its values (Y/N)?')
-                    if overwrite == 'Y' or overwrite == 'y':
-                        # Update list to be used
-                        list_cols_use = list_cols_use + 'Column: '+column_names[i]+'\n'                    
-                    elif overwrite == 'N' or overwrite == 'n':
-                        grass.error('Ok. The process was stopped. Please select another column name.\n')
-                        raise Exception('')
-                    else:
-                        grass.error('You did not type a valid option. The process was stopped.\n')
-                        raise Exception('')
-                # if the column does not exist, create it
-                else:
-                    
-                    # Check variable type
-                    if type_col[i] == 'int':
-                        type_col_str = 'integer'
-                    elif type_col[i] == 'float':
-                        type_col_str = 'double precision'
-                    elif type_col[i] == 'string':
-                        type_col_str = 'varchar(20)' # increase this number if necessary
-                        # Type date not implemented here
-                    else:
-                        g.error('Hey, one of your variables is neither int, float or string!')
-                    
-                    # Add variable and type to the list of columns to be created
-                    list_cols = list_cols+column_names[i]+' '+type_col_str
-                    if i < (len(column_names)-1):
-                        list_cols = list_cols+', '
-                    
-                    # Update list to be imported
-                    list_cols_str = list_cols_str + 'Column: '+column_names[i]+'; type: '+type_col_str+'\n'
-                    
-                    # Update list to be used
-                    list_cols_use = list_cols_use + 'Column: '+column_names[i]+'\n'                    
-                    
-                
-            # Create columns
-            if list_cols != '':
+            list_cols = ', '.join([col+' '+COLUMN_TYPES[type_name] for col, type_name in to_create])
+            
+            # Lines with col names to be shown in the end
+            list_cols_str = ['The following column(s) were created:']
+            for col, type_name in to_create:
+                list_cols_str.append('Column: '+col+'; type: '+COLUMN_TYPES[type_name])
+            
+            # Lines with col names to be used:
+            list_cols_use = ['The following column(s) will be filled by zonal statistics:']
+            for col in column_names:
+                list_cols_use.append('Column: '+col)
+            
+            # Create all columns with a single v.db.addcolumn call (none, if all of them already exist)
+            if len(to_create) > 0:
                 grass.run_command("v.db.addcolumn", map = self.input_shape, columns = list_cols)
+                
+                # Message to prompt
+                # List to be imported
+                grass.message('\n'.join(list_cols_str))
             
             # Message to prompt
-            # List to be imported
-            grass.message(list_cols_str)
             # List to be used
-            grass.message(list_cols_use)
+            grass.message('\n'.join(list_cols_use))
             
             # Initialize variable to assess if setting columns was successful
             self.set_cols = True
@@ -360,7 +1106,10 @@ class GeneralizedZonalStats():
         Parameters
         ----------
         function: Python function
-            Name of the function to be used to calculate over masks/vetor features.
+            Name of the function to be used to calculate over masks/vetor features. Functions with the
+            attribute multi_raster = True (e.g. proportion_habitat_stack) receive the list of all input rasters and 
+            return one value per raster, so that all rasters are read together for each feature. When features are
+            processed in parallel (n_workers > 1), it must be defined at the module level.
         cats: list with integers in character form ('1' and not 1)
             List with values of lines of the input vector/shape (cats), representing the polygons/features of
             this vector to be processed. The default is the string 'all', in case all polygons will be processed.
@@ -372,86 +1121,88 @@ class GeneralizedZonalStats():
         
         # If the previous steps (load/select maps, create/set columns) were done with success, go on
         if self.set_cols and self.load_ok:
-            # Get row names (cat)
-            cat_info = grass.read_command('db.select', sql = 'SELECT cat FROM '+self.input_shape).split('\n')
-            # exclude last line and header
-            cats = [val for val in cat_info if val != '' and val != 'cat']
+            # Time spent in each step (for features, summed over all features and workers)
+            phase_times = {'rasterize': 0.0, 'region': 0.0, 'mask': 0.0, 'compute': 0.0, 'update': 0.0}
             
-            # select only rows/polygons of interest, from the input shape
-            if select_cats != 'all' and len(select_cats) <= len(cats): 
-                cats = [val for val in cats if val in select_cats]
+            # Get cats of the features to be processed
+            cats = self._get_cats(select_cats)
             
-            # We can include something to calculate only for selected features and not all
+            # Bounding boxes of all features (computed once, in __init__), and features sorted in space
+            extents = self.bboxes
+            cats = _sort_cats_spatially(cats, extents)
             
-            # For each selected feature
-            for cat in cats:
-                
-                # Take resolution from raster map
-                #rast_info = r.raster_info(self.input_rasters[0])
-                #ewres = rast_info['ewres']
-                #nsres = rast_info['nsres']
-                
-                ext_polygon = grass.read_command('v.db.select', map = self.input_shape, where = 'cat = '+cat, flags = 'r')
-                ext_polygon_list = ext_polygon.split('\n')
-                n = [i for i in ext_polygon_list if 'n=' in i][0].replace('n=', '')
-                s = [i for i in ext_polygon_list if 's=' in i][0].replace('s=', '')
-                e = [i for i in ext_polygon_list if 'e=' in i][0].replace('e=', '')
-                w = [i for i in ext_polygon_list if 'w=' in i][0].replace('w=', '')                
-                
-                # Create a raster for the feature
-                #grass.run_command('g.region', vector = self.input_shape, ewres = ewres, nsres = nsres, align = self.input_rasters[0])
-                grass.run_command('g.region', n = n, s = s, e = e, w = w, align = self.input_rasters[0])
-                grass.run_command('v.to.rast', input = self.input_shape, output = 'temp_rast', cats = cat, use='val', overwrite = True)
-                
-                # Set region to the feature
-                grass.run_command('g.region', raster = 'temp_rast', zoom = 'temp_rast') 
-                
-                # Run r.mask for the feature
-                grass.run_command('r.mask', vector = self.input_shape, cats = cat, overwrite = True)
-                
-                # For each raster/column
-                for i in range(len(self.input_rasters)):
-                    
-                    # Column and raster
-                    col = self.column_names[i]
-                    rast = self.input_rasters[i]
-                    
-                    # Run function
-                    val = function(rast, *args, **kwargs)
-                    
-                    # Update value in the input shape attribute table
-                    grass.run_command('v.db.update', map = self.input_shape, column = col, value = str(val), where='cat = '+cat)
-                    
-                # Remove mask
-                grass.run_command('r.mask', flags = 'r')
-                
-                # Remove temp raster
-                grass.run_command('g.remove', flags = 'f', type = 'raster', pattern = 'temp_rast', verbose = False)
-                
-                # Message - cat ok
-                grass.message("Feature "+str(cat)+' processed with success!')
-        
-        # If any of the previous moments were not successful, stop.
-        else:
-            if not self.load_ok:
+            # Rasterize all features once, to be used as MASK for each of them
+            start = _timer()
+            zones_rast = self._rasterize_zones()
+            phase_times['rasterize'] = _timer() - start
+            
+            # Worker for a single feature
+            feature_worker = partial(_process_feature, extents = extents, input_rasters = self.input_rasters, 
+                                     column_names = self.column_names, function = function, args = args, kwargs = kwargs, 
+                                     mapset = self.mapset, grid = self.grid, zones_rast = zones_rast)
+            
+            try:
+                # Process features in parallel, each worker within its own mapset
+                # (the mapsets of the workers, and their MASKs, are removed in the end)
+                if self.n_workers > 1 and len(cats) > 1:
+                    results = self._map_features_parallel(feature_worker, cats)
+                # Or serially, within the current mapset
+                else:
+                    try:
+                        results = [feature_worker(cat) for cat in cats]
+                    finally:
+                        # Restore region and remove mask, also if a feature failed
+                        _reset_region()
+                        if grass.find_file(name = 'MASK', element = 'cell', mapset = self.mapset)['name']:
+                            grass.run_command('r.mask', flags = 'r')
+            finally:
+                # Remove raster of zones
+                self._remove_zones(zones_rast)
+            
+            # Time of each step for the features
+            for feature_results, times in results:
+                for phase in times:
+                    phase_times[phase] += times[phase]
+            
+            # Update values in the input shape attribute table, in a single transaction
+            start = _timer()
+            self._update_values([item for feature_results, times in results for item in feature_results])
+            phase_times['update'] = _timer() - start
+            
+            # Message - time of each step (the steps of the features are summed over all features and workers,
+            # so in parallel they may add up to more than the elapsed time)
+            grass.message('Time (s) of each step: '+'; '.join([phase+': '+'%.3f' % phase_times[phase] 
+                                                                for phase in ['rasterize', 'update']])+
+                          '. Summed over all features/workers: '+'; '.join([phase+': '+'%.3f' % phase_times[phase] 
+                                                                             for phase in ['region', 'mask', 'compute']]))
+        
+        # If any of the previous moments were not successful, stop.
+        else:
+            if not self.load_ok:
                 raise Exception('Maps were not loaded successfully. Please retry.')
             
             if not self.set_cols:
                 raise Exception('Columns were not set successfully. Please retry.')
             
             
-    # Function run_zonal_stats v2 - run the the function passed as argument for each zone/feature
-    def run_zonal_stats_v2(self, function, select_cats = 'all', *args, **kwargs):
+    # Function run_zonal_stats_array - run a function over the numpy arrays of each zone/feature
+    def run_zonal_stats_array(self, function, select_cats = 'all', *args, **kwargs):
         '''
-        Function run_zonal_stats
+        Function run_zonal_stats_array
         
-        This function ...
+        This function is an alternative to run_zonal_stats for functions that work on numpy arrays (e.g. 
+        proportion_habitat_array, number_patches_array), instead of raster names. For each feature, the
+        input rasters are read once as arrays and no MASK or temporary rasters are created, so the function
+        itself does not need to spawn any GRASS module. If prefetch was called before, the rasters are not 
+        read again: the values of each feature are sliced from the stack of rasters in memory.
         
         Parameters
         ----------
         function: Python function
-            Name of the function to be used to calculate over masks/vetor features.
-        cats: list with integers in character form ('1' and not 1)
+            Function to be used to calculate over vetor features. It receives a 1-dimensional numpy array
+            with the values of the raster within the feature (null cells as NaN). When features are
+            processed in parallel (n_workers > 1), it must be defined at the module level.
+        select_cats: list with integers in character form ('1' and not 1)
             List with values of lines of the input vector/shape (cats), representing the polygons/features of
             this vector to be processed. The default is the string 'all', in case all polygons will be processed.
         *args: several
@@ -462,66 +1213,1058 @@ class GeneralizedZonalStats():
         
         # If the previous steps (load/select maps, create/set columns) were done with success, go on
         if self.set_cols and self.load_ok:
-            # Get row names (cat)
-            cat_info = grass.read_command('db.select', sql = 'SELECT cat FROM '+self.input_shape).split('\n')
-            # exclude last line and header
-            cats = [val for val in cat_info if val != '' and val != 'cat']
+            # Get cats of the features to be processed
+            cats = self._get_cats(select_cats)
             
-            # select only rows/polygons of interest, from the input shape
-            if select_cats != 'all' and len(select_cats) <= len(cats): 
-                cats = [val for val in cats if val in select_cats]
+            # Bounding boxes of all features (computed once, in __init__), and features sorted in space
+            extents = self.bboxes
+            cats = _sort_cats_spatially(cats, extents)
             
-            # We can include something to calculate only for selected features and not all
+            # If the rasters were already read to memory (prefetch), just slice them for each feature
+            if self.raster_stack is not None:
+                self._update_values(self._run_features_stack(function, cats, extents, args, kwargs))
+                return
             
-            # For each selected feature
-            for cat in cats:
+            # Rasterize all features once, to select the cells of each of them
+            zones_rast = self._rasterize_zones()
+            
+            # Worker for a single feature
+            feature_worker = partial(_process_feature_array, extents = extents, input_rasters = self.input_rasters, 
+                                     column_names = self.column_names, function = function, args = args, kwargs = kwargs, 
+                                     mapset = self.mapset, grid = self.grid, zones_rast = zones_rast)
+            
+            try:
+                # Process features in parallel, each worker within its own mapset, or serially
+                if self.n_workers > 1 and len(cats) > 1:
+                    results = self._map_features_parallel(feature_worker, cats)
+                else:
+                    try:
+                        results = [feature_worker(cat) for cat in cats]
+                    finally:
+                        _reset_region()
+            finally:
+                # Remove raster of zones
+                self._remove_zones(zones_rast)
+            
+            # Update values in the input shape attribute table, in a single transaction
+            self._update_values([item for feature_results in results for item in feature_results])
+        
+        # If any of the previous moments were not successful, stop.
+        else:
+            if not self.load_ok:
+                raise Exception('Maps were not loaded successfully. Please retry.')
+            
+            if not self.set_cols:
+                raise Exception('Columns were not set successfully. Please retry.')
+        
+    # Function run_zonal_stats_multi - run several functions over several rasters, reading each raster once per feature
+    def run_zonal_stats_multi(self, stats_spec, select_cats = 'all'):
+        '''
+        Function run_zonal_stats_multi
+        
+        This function is similar to run_zonal_stats_array, but each column is calculated by its own function 
+        over its own raster. For each feature, the region is set and each raster is read only once, and all 
+        the functions are run over these arrays (e.g. proportion of habitat and number of patches for several 
+        years in a single run). The rasters must be aligned to the same grid, which is checked before.
+        
+        Parameters
+        ----------
+        stats_spec: list with tuples
+            List of (column, function, raster) tuples. The functions receive a 1-dimensional numpy array
+            with the values of the raster within the feature (null cells as NaN), as in run_zonal_stats_array. 
+            The columns must already exist in the attribute table of the input vector.
+        select_cats: list with integers in character form ('1' and not 1)
+            List with values of lines of the input vector/shape (cats), representing the polygons/features of
+            this vector to be processed. The default is the string 'all', in case all polygons will be processed.
+            
+        Returns
+        -------
+        None.
+        '''
+        
+        # Columns, functions, and rasters
+        column_names = [col for col, func, rast in stats_spec]
+        functions = [func for col, func, rast in stats_spec]
+        input_rasters = [rast for col, func, rast in stats_spec]
+        
+        # Check columns
+        existing_cols = set(v.vector_columns(self.input_shape).keys())
+        for col in column_names:
+            if col not in existing_cols:
+                raise ValueError('Column '+col+' does not exist in the attribute table of '+self.input_shape+'. Please create it with create_new_column.')
+        
+        # Check if all rasters are aligned to the grid of the first input raster
+        for rast in set(input_rasters):
+            info = r.raster_info(rast)
+            same_res = (abs(info['nsres'] - self.nsres) < 1e-9*self.nsres) and (abs(info['ewres'] - self.ewres) < 1e-9*self.ewres)
+            rows_off = (self.grid['north'] - info['north'])/self.nsres
+            cols_off = (info['west'] - self.grid['west'])/self.ewres
+            if not (same_res and abs(rows_off - round(rows_off)) < 1e-6 and abs(cols_off - round(cols_off)) < 1e-6):
+                raise ValueError('The raster '+rast+' is not aligned to the raster '+self.input_rasters[0]+'. Please resample it to the same grid.')
+        
+        # If the previous step (load/select maps) was done with success, go on
+        if self.load_ok:
+            # Get cats of the features to be processed
+            cats = self._get_cats(select_cats)
+            
+            # Bounding boxes of all features (computed once, in __init__), and features sorted in space
+            extents = self.bboxes
+            cats = _sort_cats_spatially(cats, extents)
+            
+            # Rasterize all features once, to select the cells of each of them
+            zones_rast = self._rasterize_zones()
+            
+            # Worker for a single feature, with one function per raster/column
+            feature_worker = partial(_process_feature_array, extents = extents, input_rasters = input_rasters, 
+                                     column_names = column_names, function = functions, args = (), kwargs = {}, 
+                                     mapset = self.mapset, grid = self.grid, zones_rast = zones_rast)
+            
+            try:
+                # Process features in parallel, each worker within its own mapset, or serially
+                if self.n_workers > 1 and len(cats) > 1:
+                    results = self._map_features_parallel(feature_worker, cats)
+                else:
+                    try:
+                        results = [feature_worker(cat) for cat in cats]
+                    finally:
+                        _reset_region()
+            finally:
+                # Remove raster of zones
+                self._remove_zones(zones_rast)
+            
+            # Update values in the input shape attribute table, in a single transaction
+            self._update_values([item for feature_results in results for item in feature_results])
+        
+        # If any of the previous moments were not successful, stop.
+        else:
+            raise Exception('Maps were not loaded successfully. Please retry.')
+        
+    # Function prefetch - read all input rasters to memory at once
+    def prefetch(self, memmap = False):
+        '''
+        Function prefetch
+        
+        This function reads the raster of zones (all features rasterized with their cats) and all input
+        rasters once, over the extent of the input vector aligned to the first raster, and keeps them as a
+        3-dimensional array (rasters x rows x columns) of float32. After that, run_zonal_stats_array
+        only slices this array for each feature, without reading rasters again.
+        
+        Parameters
+        ----------
+        memmap: bool (True/False)
+            If True, the array is kept in a temporary file (numpy memmap), for rasters too large to fit
+            in memory. If False (default), it is kept in memory.
+            
+        Returns
+        -------
+        None.
+        '''
+        
+        # Rasterize all features at once, with their cats as values
+        zones_rast = self._rasterize_zones()
+        
+        # Region of the raster of zones, aligned to the first raster
+        grass.use_temp_region()
+        try:
+            grass.run_command('g.region', raster = zones_rast)
+            region = grass.region()
+            
+            # Zones and grid of the arrays
+            self.zones_array = np.asarray(garray.array(zones_rast, null = 'nan')).astype(np.float32)
+            self.stack_grid = {'north': region['n'], 'west': region['w'], 'nsres': region['nsres'], 'ewres': region['ewres'],
+                               'rows': region['rows'], 'cols': region['cols']}
+            
+            # Stack of rasters, filled one raster at a time
+            shape = (len(self.input_rasters), region['rows'], region['cols'])
+            if memmap:
+                stack = np.memmap(grass.tempfile(), dtype = np.float32, mode = 'w+', shape = shape)
+            else:
+                stack = np.empty(shape, dtype = np.float32)
+            for i in range(len(self.input_rasters)):
+                stack[i] = garray.array(self.input_rasters[i], null = 'nan')
+            self.raster_stack = stack
+            
+            # Masks of the features are computed again for the new raster of zones
+            self._mask_cache = {}
+        finally:
+            # Restore region
+            grass.del_temp_region()
+        
+        # Remove raster of zones
+        self._remove_zones(zones_rast)
+        
+        grass.message('The input rasters were read to memory.')
+        
+    # Function _run_features_stack - run a function over the stack of rasters, for each feature
+    def _run_features_stack(self, function, cats, extents, args, kwargs):
+        '''
+        Function _run_features_stack
+        
+        This function runs the function passed as argument for each feature and raster, over the stack of 
+        rasters read by prefetch. For each feature, the window of its bounding box is sliced from the stack 
+        and the cells of the feature are selected from all rasters at once.
+        
+        Returns
+        -------
+        results: list with tuples
+            List of (cat, column, value) tuples.
+        '''
+        
+        results = []
+        for cat in cats:
+            
+            # Window and mask of the feature within the stack
+            rows, cols, in_feature = self._feature_mask(cat, extents)
+            
+            # Values of all rasters within the feature, in a single slice
+            values = self.raster_stack[:, rows, cols][:, in_feature]
+            
+            # For each raster/column
+            for i in range(len(self.input_rasters)):
+                val = function(values[i], *args, **kwargs)
+                results.append((cat, self.column_names[i], val))
+            
+            # Message - cat ok
+            grass.message("Feature "+str(cat)+' processed with success!')
+        
+        return results
+        
+    # Function _feature_mask - window and boolean mask of a feature within the stack of rasters
+    def _feature_mask(self, cat, extents):
+        '''
+        Function _feature_mask
+        
+        This function returns the window (slices of rows and columns) of the bounding box of a feature 
+        within the stack of rasters read by prefetch, and the boolean mask of the cells of the feature
+        within this window. The masks are kept bit-packed (np.packbits, 1 bit per cell) in a cache, so that 
+        they are computed only once for each feature while the stack is not read again.
+        
+        Returns
+        -------
+        rows, cols: slices
+            Rows and columns of the window of the feature.
+        in_feature: numpy array of bool
+            Mask of the cells of the feature within the window.
+        '''
+        
+        # Mask already computed
+        if cat in self._mask_cache:
+            rows, cols, packed = self._mask_cache[cat]
+            shape = (rows.stop - rows.start, cols.stop - cols.start)
+            in_feature = np.unpackbits(packed, count = shape[0]*shape[1]).reshape(shape).astype(bool)
+            return rows, cols, in_feature
+        
+        # Rows and columns of the feature bounding box within the stack
+        rows, cols = _bbox_window(extents[cat], self.stack_grid)
+        
+        # Mask of the feature, kept bit-packed
+        in_feature = self.zones_array[rows, cols] == int(cat)
+        self._mask_cache[cat] = (rows, cols, np.packbits(in_feature.ravel()))
+        
+        return rows, cols, in_feature
+        
+    # Function open_rasterio - export the input rasters once and keep them open with rasterio
+    def open_rasterio(self):
+        '''
+        Function open_rasterio
+        
+        This function exports each input raster once, over its whole extent, as a tiled Float32 GeoTIFF
+        in a temporary folder, and keeps them open with rasterio, to be read window by window by 
+        run_zonal_stats_fast. The rasters stay open until close_rasterio is called. It requires rasterio.
+        
+        Returns
+        -------
+        None.
+        '''
+        
+        if rasterio is None:
+            raise ImportError('Reading rasters with rasterio requires rasterio. Please install it or use run_zonal_stats_array.')
+        
+        # Already open
+        if self._rio is not None:
+            return
+        
+        self._rio_dir = tempfile.mkdtemp()
+        self._rio = {}
+        try:
+            for rast in self.input_rasters:
+                raster_file = os.path.join(self._rio_dir, rast.split('@')[0]+'.tif')
+                grass.use_temp_region()
+                try:
+                    grass.run_command('g.region', raster = rast)
+                    grass.run_command('r.out.gdal', input = rast, output = raster_file, format = 'GTiff', type = 'Float32', 
+                                      createopt = 'TILED=YES', flags = 'c', quiet = True)
+                finally:
+                    grass.del_temp_region()
+                self._rio[rast] = rasterio.open(raster_file, sharing = False)
+        except Exception:
+            self.close_rasterio()
+            raise
+        
+    # Function close_rasterio - close the rasters opened with rasterio and remove their files
+    def close_rasterio(self):
+        '''
+        Function close_rasterio
+        
+        This function closes the rasters opened by open_rasterio and removes the exported files.
+        '''
+        
+        if self._rio is not None:
+            for src in self._rio.values():
+                src.close()
+        if self._rio_dir is not None:
+            shutil.rmtree(self._rio_dir, ignore_errors = True)
+        
+        self._rio = None
+        self._rio_dir = None
+        self._scratch = None
+        
+    # Function _read_window - read the window of a raster covering a feature, with rasterio
+    def _read_window(self, rast, geom, bbox):
+        '''
+        Function _read_window
+        
+        This function reads, from a raster opened by open_rasterio, only the window covering the bounding 
+        box of a feature, and rasterizes the feature within this window. The window is read into a buffer 
+        that is kept between calls (and only grows when a larger window is needed), so no new array is 
+        allocated for each feature and raster.
+        
+        Parameters
+        ----------
+        rast: string
+            Name of the input raster.
+        geom: dictionary
+            Geometry of the feature, in GeoJSON format.
+        bbox: tuple
+            Bounding box of the feature (w, s, e, n).
+            
+        Returns
+        -------
+        values: numpy array
+            Values of the raster within the window (null cells as NaN). It is a view of the buffer, so it is
+            overwritten by the next call.
+        in_feature: numpy array
+            Boolean array, True for the cells of the window within the feature.
+        '''
+        
+        src = self._rio[rast]
+        w, s, e, n = bbox
+        
+        # Window covering the bounding box, expanded to whole cells and clipped to the raster
+        window = rasterio.windows.from_bounds(w, s, e, n, transform = src.transform)
+        col_off = int(math.floor(window.col_off))
+        row_off = int(math.floor(window.row_off))
+        window = rasterio.windows.Window(col_off, row_off, int(math.ceil(window.col_off + window.width)) - col_off, 
+                                         int(math.ceil(window.row_off + window.height)) - row_off)
+        window = window.intersection(rasterio.windows.Window(0, 0, src.width, src.height))
+        height, width = int(window.height), int(window.width)
+        
+        # Grow the buffer, if needed
+        if self._scratch is None or self._scratch.shape[0] < height or self._scratch.shape[1] < width:
+            shape = (height, width) if self._scratch is None else (max(height, self._scratch.shape[0]), max(width, self._scratch.shape[1]))
+            self._scratch = np.empty(shape, dtype = np.float32)
+        
+        # Values within the window, read into the buffer
+        values = self._scratch[:height, :width]
+        src.read(1, window = window, out = values)
+        if src.nodata is not None and src.nodata == src.nodata:
+            values[values == src.nodata] = np.nan
+        
+        # Rasterize the feature within the window
+        in_feature = rasterio.features.rasterize([(geom, 1)], out_shape = values.shape, transform = src.window_transform(window), 
+                                                 fill = 0, dtype = 'uint8') == 1
+        
+        return values, in_feature
+        
+    # Function run_zonal_stats_rows - run a function over the values of each zone/feature, read row by row
+    def run_zonal_stats_rows(self, function, select_cats = 'all', *args, **kwargs):
+        '''
+        Function run_zonal_stats_rows
+        
+        This function is an alternative to run_zonal_stats_array with low memory use. The raster of zones
+        and the input rasters are opened once with pygrass (RasterRow) and, for each feature, only the rows
+        within its bounding box are read, one at a time; only the values of the cells of the feature are 
+        kept. The region is never changed: rows are read within the current region, which must cover the
+        features. Features are processed serially.
+        
+        Parameters
+        ----------
+        function: Python function
+            Function to be used to calculate over vetor features. It receives a 1-dimensional numpy array
+            with the values of the raster within the feature (null cells as NaN), as in run_zonal_stats_array.
+        select_cats: list with integers in character form ('1' and not 1)
+            List with values of lines of the input vector/shape (cats), representing the polygons/features of
+            this vector to be processed. The default is the string 'all', in case all polygons will be processed.
+        *args: several
+            Argument of the function, not named (only value, e.g. 30, 'int')
+        **kwargs: several
+            Optional arguments of the function, named (option = value, e.g. threshold = 50)
+        '''
+        
+        # If the previous steps (load/select maps, create/set columns) were done with success, go on
+        if self.set_cols and self.load_ok:
+            # Get cats of the features to be processed, sorted in space
+            cats = _sort_cats_spatially(self._get_cats(select_cats), self.bboxes)
+            
+            # Rasterize all features once, to select the cells of each of them
+            zones_rast = self._rasterize_zones()
+            
+            # Grid of the current region, where rows are read
+            region = Region()
+            grid = {'north': region.north, 'west': region.west, 'nsres': region.nsres, 'ewres': region.ewres,
+                    'rows': region.rows, 'cols': region.cols}
+            
+            # Open all maps once
+            zones = RasterRow(zones_rast)
+            maps = [RasterRow(rast) for rast in self.input_rasters]
+            zones.open('r')
+            try:
+                for rast_map in maps:
+                    rast_map.open('r')
+                
+                # For each selected feature
+                results = []
+                for cat in cats:
+                    rows, cols = _bbox_window(self.bboxes[cat], grid)
+                    
+                    # Values within the feature, row by row
+                    values = [[] for rast_map in maps]
+                    for row in range(rows.start, rows.stop):
+                        in_feature = np.asarray(zones.get_row(row))[cols] == int(cat)
+                        if not in_feature.any():
+                            continue
+                        for i in range(len(maps)):
+                            row_values = np.asarray(maps[i].get_row(row))[cols][in_feature].astype(np.float64)
+                            # Null cells of integer maps as NaN (floating point maps already have NaN)
+                            if maps[i].mtype == 'CELL':
+                                row_values[row_values == -2147483648] = np.nan
+                            values[i].append(row_values)
+                    
+                    # For each raster/column
+                    for i in range(len(maps)):
+                        vals = np.concatenate(values[i]) if len(values[i]) > 0 else np.empty(0)
+                        results.append((cat, self.column_names[i], function(vals, *args, **kwargs)))
+                    
+                    # Message - cat ok
+                    grass.message("Feature "+str(cat)+' processed with success!')
+            
+            finally:
+                # Close maps
+                for rast_map in maps:
+                    if rast_map.is_open():
+                        rast_map.close()
+                zones.close()
+            
+            # Remove raster of zones
+            self._remove_zones(zones_rast)
+            
+            # Update values in the input shape attribute table, in a single transaction
+            self._update_values(results)
+        
+        # If any of the previous moments were not successful, stop.
+        else:
+            if not self.load_ok:
+                raise Exception('Maps were not loaded successfully. Please retry.')
+            
+            if not self.set_cols:
+                raise Exception('Columns were not set successfully. Please retry.')
+        
+    # Function run_zonal_stats_fast - run a function over windowed reads of each zone/feature, with rasterio
+    def run_zonal_stats_fast(self, function, select_cats = 'all', *args, **kwargs):
+        '''
+        Function run_zonal_stats_fast
+        
+        This function is an alternative to run_zonal_stats_array that bypasses GRASS for the per-feature
+        computation. The input vector and rasters are exported once (GeoJSON and GeoTIFF) and the rasters are
+        opened once with rasterio; for each feature, only the window of each raster covering the feature 
+        bounding box is read, and the feature is rasterized within that window to select its cells.
+        If the rasters were already opened (use_rasterio = True or open_rasterio), they are not exported 
+        again and are kept open in the end. It requires rasterio.
+        
+        Parameters
+        ----------
+        function: Python function
+            Function to be used to calculate over vetor features. It receives a 1-dimensional numpy array
+            with the values of the raster within the feature (null cells as NaN), as in run_zonal_stats_array.
+        select_cats: list with integers in character form ('1' and not 1)
+            List with values of lines of the input vector/shape (cats), representing the polygons/features of
+            this vector to be processed. The default is the string 'all', in case all polygons will be processed.
+        *args: several
+            Argument of the function, not named (only value, e.g. 30, 'int')
+        **kwargs: several
+            Optional arguments of the function, named (option = value, e.g. threshold = 50)
+        '''
+        
+        if rasterio is None:
+            raise ImportError('run_zonal_stats_fast requires rasterio. Please install it or use run_zonal_stats_array.')
+        
+        # If the previous steps (load/select maps, create/set columns) were done with success, go on
+        if self.set_cols and self.load_ok:
+            # Get cats of the features to be processed
+            cats = self._get_cats(select_cats)
+            
+            # Open the rasters with rasterio, if they are not open yet
+            keep_open = self._rio is not None
+            self.open_rasterio()
+            
+            # Folder for the exported vector
+            temp_dir = tempfile.mkdtemp()
+            try:
+                # Export the vector once and get the geometry of each feature
+                # (flag m: areas with the same cat are exported as a single multi-part feature)
+                vector_file = os.path.join(temp_dir, 'zones.geojson')
+                grass.run_command('v.out.ogr', flags = 'm', input = self.input_shape, output = vector_file, format = 'GeoJSON', type = 'area', quiet = True)
+                with open(vector_file) as f:
+                    features = json.load(f)['features']
+                geometries = dict((str(feat['properties']['cat']), feat['geometry']) for feat in features)
+                
+                # For each selected feature
+                results = []
+                for cat in cats:
+                    
+                    # Cats with no area (e.g. only lines or points) are skipped and their values are not updated
+                    geom = geometries.get(cat)
+                    if geom is None:
+                        grass.warning('Feature '+str(cat)+' has no area and was not processed.')
+                        continue
+                    w, s, e, n = rasterio.features.bounds(geom)
+                    
+                    # For each raster/column
+                    for i in range(len(self.input_rasters)):
+                        
+                        # Column and raster
+                        col = self.column_names[i]
+                        rast = self.input_rasters[i]
+                        
+                        # Read only the window covering the feature
+                        values, in_feature = self._read_window(rast, geom, (w, s, e, n))
+                        
+                        # Run function over the values within the feature
+                        val = function(values[in_feature], *args, **kwargs)
+                        
+                        # Keep the value, to be written in the input shape attribute table later
+                        results.append((cat, col, val))
+                    
+                    # Message - cat ok
+                    grass.message("Feature "+str(cat)+' processed with success!')
+            
+            finally:
+                # Remove the exported vector, and close the rasters if they were opened here
+                shutil.rmtree(temp_dir, ignore_errors = True)
+                if not keep_open:
+                    self.close_rasterio()
+            
+            # Update values in the input shape attribute table, in a single transaction
+            self._update_values(results)
+        
+        # If any of the previous moments were not successful, stop.
+        else:
+            if not self.load_ok:
+                raise Exception('Maps were not loaded successfully. Please retry.')
+            
+            if not self.set_cols:
+                raise Exception('Columns were not set successfully. Please retry.')
+        
+    # Function run_zonal_stats_bulk - compute zonal statistics for all features with one GRASS module per raster
+    def run_zonal_stats_bulk(self, method = 'proportion', select_cats = 'all'):
+        '''
+        Function run_zonal_stats_bulk
+        
+        This function computes the statistics of all features at once, with a single GRASS module call for 
+        each input raster over a raster of zones (all features rasterized with their cats), instead of 
+        setting the region and MASK for each feature. It covers the built-in metrics: 'proportion' (the 
+        same as proportion_habitat, for binary 1/0 maps) and the statistics of r.univar are computed with
+        r.univar -t; 'np' (the same as number_patches, for pid maps) is computed with r.stats -n.
+        Other functions still need run_zonal_stats. The module calls for the different rasters are
+        independent, so up to n_workers of them run at the same time, in a pygrass ParallelModuleQueue;
+        their outputs are parsed and all values are written to the attribute table at once in the end.
+        
+        Parameters
+        ----------
+        method: string; {'proportion', 'np', 'sum', 'count', 'mean', 'min', 'max'}
+            Statistic to be calculated for each feature.
+        select_cats: list with integers in character form ('1' and not 1)
+            List with values of lines of the input vector/shape (cats), representing the polygons/features of
+            this vector to be processed. The default is the string 'all', in case all polygons will be processed.
+            
+        Returns
+        -------
+        None.
+        '''
+        
+        # Check method
+        if method not in ['proportion', 'np', 'sum', 'count', 'mean', 'min', 'max']:
+            raise ValueError('Method '+method+' not implemented. Please choose proportion, np, sum, count, mean, min, or max.')
+        
+        # If the previous steps (load/select maps, create/set columns) were done with success, go on
+        if self.set_cols and self.load_ok:
+            # Get cats of the features to be processed
+            cats = self._get_cats(select_cats)
+            
+            # Rasterize all features at once, with their cats as values
+            zones_rast = self._rasterize_zones()
+            
+            # Region of the raster of zones
+            grass.use_temp_region()
+            try:
+                grass.run_command('g.region', raster = zones_rast)
                 
-                # Take resolution from raster map
-                #rast_info = r.raster_info(self.input_rasters[0])
-                #ewres = rast_info['ewres']
-                #nsres = rast_info['nsres']
+                # Features with no valid cells have no patches/cells, and no value for the other statistics
+                default = 0 if method in ['np', 'count'] else None
                 
-                ext_polygon = grass.read_command('v.db.select', map = self.input_shape, where = 'cat = '+cat, flags = 'r')
-                ext_polygon_list = ext_polygon.split('\n')
-                n = [i for i in ext_polygon_list if 'n=' in i][0].replace('n=', '')
-                s = [i for i in ext_polygon_list if 's=' in i][0].replace('s=', '')
-                e = [i for i in ext_polygon_list if 'e=' in i][0].replace('e=', '')
-                w = [i for i in ext_polygon_list if 'w=' in i][0].replace('w=', '')                
+                # Run the module calls for all rasters, several at a time, in a queue of GRASS modules
+                queue = ParallelModuleQueue(nprocs = max(1, min(self.n_workers, len(self.input_rasters))))
+                modules = []
+                for rast in self.input_rasters:
+                    module = _zonal_module(zones_rast, rast, method)
+                    modules.append(module)
+                    queue.put(module)
+                queue.wait()
                 
-                # Create a raster for the feature
-                #grass.run_command('g.region', vector = self.input_shape, ewres = ewres, nsres = nsres, align = self.input_rasters[0])
-                grass.run_command('g.region', n = n, s = s, e = e, w = w, align = self.input_rasters[0])
-                grass.run_command('v.to.rast', input = self.input_shape, output = 'temp_rast', cats = cat, use='val', overwrite = True)
+                # Statistics of all zones for each raster
+                all_stats = [_parse_zonal_stats(module.outputs.stdout, method) for module in modules]
+                
+                # For each raster/column
+                results = []
+                for i in range(len(self.input_rasters)):
+                    
+                    # Column and raster
+                    col = self.column_names[i]
+                    rast = self.input_rasters[i]
+                    stats = all_stats[i]
+                    
+                    results += [(cat, col, stats.get(cat, default)) for cat in cats]
+                    
+                    grass.message('Raster '+rast+' processed with success!')
+            finally:
+                # Restore region
+                grass.del_temp_region()
+            
+            # Remove raster of zones
+            self._remove_zones(zones_rast)
+            
+            # Update values in the input shape attribute table, in a single transaction
+            self._update_values(results)
+        
+        # If any of the previous moments were not successful, stop.
+        else:
+            if not self.load_ok:
+                raise Exception('Maps were not loaded successfully. Please retry.')
+            
+            if not self.set_cols:
+                raise Exception('Columns were not set successfully. Please retry.')
+        
+    # Function run_zonal_stats_ndimage - compute statistics for all features at once with scipy.ndimage
+    def run_zonal_stats_ndimage(self, metric = 'prop_habitat', select_cats = 'all'):
+        '''
+        Function run_zonal_stats_ndimage
+        
+        This function computes the statistics of all features at once with scipy.ndimage, over the 
+        raster of zones (all features rasterized with their cats) and each input raster read as numpy
+        arrays. Each statistic is computed for all zones in a single pass over the arrays, instead of
+        one MASK and one function call per feature. Null cells of the input rasters are not considered.
+        
+        Parameters
+        ----------
+        metric: string; {'prop_habitat', 'np', 'mean', 'sum', 'min', 'max'}
+            Statistic to be calculated for each feature: 'prop_habitat' is the same as proportion_habitat 
+            (for binary 1/0 maps), 'np' is the same as number_patches (for pid maps).
+        select_cats: list with integers in character form ('1' and not 1)
+            List with values of lines of the input vector/shape (cats), representing the polygons/features of
+            this vector to be processed. The default is the string 'all', in case all polygons will be processed.
+            
+        Returns
+        -------
+        None.
+        '''
+        
+        # Check if scipy is available
+        if ndimage is None:
+            raise ImportError('run_zonal_stats_ndimage needs scipy. Please install it or use run_zonal_stats_bulk.')
+        
+        # Check metric
+        if metric not in ['prop_habitat', 'np', 'mean', 'sum', 'min', 'max']:
+            raise ValueError('Metric '+metric+' not implemented. Please choose prop_habitat, np, mean, sum, min, or max.')
+        
+        # If the previous steps (load/select maps, create/set columns) were done with success, go on
+        if self.set_cols and self.load_ok:
+            # Get cats of the features to be processed
+            cats = self._get_cats(select_cats)
+            index = np.array([int(cat) for cat in cats])
+            
+            # Rasterize all features at once, with their cats as values, and read them
+            zones_rast = self._rasterize_zones()
+            
+            grass.use_temp_region()
+            try:
+                grass.run_command('g.region', raster = zones_rast)
+                zones = np.nan_to_num(np.asarray(garray.array(zones_rast, null = 'nan'))).astype(np.int64)
                 
-                # Set region to the feature
-                grass.run_command('g.region', raster = 'temp_rast', zoom = 'temp_rast') 
+                # Features with no valid cells have no patches, and no value for the other statistics
+                default = 0 if metric == 'np' else None
                 
                 # For each raster/column
+                results = []
                 for i in range(len(self.input_rasters)):
                     
                     # Column and raster
                     col = self.column_names[i]
                     rast = self.input_rasters[i]
                     
-                    # Run the equivalent to 'r.mask' for the feature, but with r.mapcalc
-                    rast_cut = 'temp_rast_input'
-                    expression = rast_cut+' = if(temp_rast == 1, '+rast+', null())'
-                    grass.mapcalc(expression, overwrite = True)
+                    # Raster values; null cells are removed from all zones (label 0)
+                    values = np.asarray(garray.array(rast, null = 'nan'))
+                    valid = ~np.isnan(values)
+                    labels = np.where(valid, zones, 0)
+                    
+                    # Number of valid cells of each zone
+                    counts = ndimage.sum(valid, labels, index = index)
                     
-                    # Run function
-                    val = function(rast_cut, *args, **kwargs)
+                    # Statistics of all zones
+                    if metric == 'prop_habitat':
+                        stats = 100.0 * ndimage.sum(values == 1, labels, index = index) / np.maximum(counts, 1)
+                    elif metric == 'np':
+                        stats = ndimage.labeled_comprehension(values, labels, index, number_patches_array, float, 0)
+                    elif metric == 'mean':
+                        stats = ndimage.mean(values, labels, index = index)
+                    elif metric == 'sum':
+                        stats = ndimage.sum(values, labels, index = index)
+                    elif metric == 'min':
+                        stats = ndimage.minimum(values, labels, index = index)
+                    else:
+                        stats = ndimage.maximum(values, labels, index = index)
                     
-                    # Update value in the input shape attribute table
-                    grass.run_command('v.db.update', map = self.input_shape, column = col, value = str(val), where='cat = '+cat)
+                    for cat, count, val in zip(cats, counts, stats):
+                        if count == 0:
+                            val = default
+                        elif metric == 'np':
+                            val = int(val)
+                        else:
+                            val = float(val)
+                        results.append((cat, col, val))
                     
-                    # Remove raster of interest for the polygon
-                    grass.run_command('g.remove', flags = 'f', type = 'raster', pattern = rast_cut, verbose = False)
-                
-                # Remove temp raster
-                grass.run_command('g.remove', flags = 'f', type = 'raster', pattern = 'temp_rast', verbose = False)
+                    grass.message('Raster '+rast+' processed with success!')
+            finally:
+                # Restore region
+                grass.del_temp_region()
+            
+            # Remove raster of zones
+            self._remove_zones(zones_rast)
+            
+            # Update values in the input shape attribute table, in a single transaction
+            self._update_values(results)
+        
+        # If any of the previous moments were not successful, stop.
+        else:
+            if not self.load_ok:
+                raise Exception('Maps were not loaded successfully. Please retry.')
+            
+            if not self.set_cols:
+                raise Exception('Columns were not set successfully. Please retry.')
+        
+    # Function _rasterize_zones - rasterize all features of the input vector at once
+    def _rasterize_zones(self, zones_rast = 'temp_zones_rast'):
+        '''
+        Function _rasterize_zones
+        
+        This function rasterizes all features of the input vector in a single v.to.rast call, using
+        their cats as values, within the extent of the vector aligned to the first input raster.
+        The current region is not changed. If a raster of zones was given when the class was initialized
+        (zone_raster), nothing is done and its name is returned.
+        
+        Parameters
+        ----------
+        zones_rast: string
+            Name of the output raster of zones.
+            
+        Returns
+        -------
+        zones_rast: string
+            Name of the output raster of zones.
+        '''
+        
+        # Raster of zones provided by the user
+        if self.zone_raster:
+            return self.zone_raster
+        
+        grass.use_temp_region()
+        try:
+            grass.run_command('g.region', vector = self.input_shape, align = self.input_rasters[0])
+            grass.run_command('v.to.rast', input = self.input_shape, output = zones_rast, use = 'cat', overwrite = True)
+        finally:
+            grass.del_temp_region()
+        
+        return zones_rast
+        
+    # Function _remove_zones - remove the temporary raster of zones
+    def _remove_zones(self, zones_rast):
+        '''
+        Function _remove_zones
+        
+        This function removes the raster of zones created by _rasterize_zones, unless it is the raster of
+        zones provided by the user (zone_raster).
+        '''
+        
+        if zones_rast != self.zone_raster:
+            grass.run_command('g.remove', flags = 'f', type = 'raster', name = zones_rast, verbose = False)
+        
+    # Function _get_cats - get the cats of the features to be processed
+    def _get_cats(self, select_cats = 'all'):
+        '''
+        Function _get_cats
+        
+        This function returns the cats of the features of the input vector, read from the attribute table
+        linked to it, optionally keeping only the selected ones.
+        
+        Parameters
+        ----------
+        select_cats: list with integers in character form ('1' and not 1)
+            List with the cats to be kept. The default is the string 'all', in case all features are kept.
+            
+        Returns
+        -------
+        cats: list with strings
+            List with the cats of the features, in character form.
+        '''
+        
+        # Get row names (cat) from the table linked to the vector
+        cats = [str(cat) for cat in sorted(grass.vector_db_select(self.input_shape, columns = 'cat')['values'])]
+        
+        # select only rows/polygons of interest, from the input shape
+        if select_cats != 'all':
+            select_cats = [str(cat) for cat in select_cats]
+            cats = [val for val in cats if val in select_cats]
+        
+        return cats
+        
+    # Function _update_values - write zonal stats values in the attribute table
+    def _update_values(self, values):
+        '''
+        Function _update_values
+        
+        This function writes the values calculated by the zonal statistics in the attribute table
+        of the input vector. All updates are written to a single SQL file run by one db.execute call,
+        within a transaction, instead of one v.db.update call for each feature and column. Each column is
+        updated with a single UPDATE statement (for up to MAX_CASE_ROWS features), choosing the value of 
+        each feature with CASE; for DBF, which does not support CASE, each feature is updated with a single
+        UPDATE statement setting all its columns. If the table is in a SQLite database (the default in 
+        GRASS GIS 7), the database is opened directly and all columns of each feature are updated by one
+        statement, run with executemany in a single transaction, without any GRASS module call.
+        
+        Parameters
+        ----------
+        values: list with tuples
+            List of (cat, column, value) tuples to be written.
+            
+        Returns
+        -------
+        None.
+        '''
+        
+        if len(values) == 0:
+            return
+        
+        # Table and database linked to the input vector
+        db_info = v.vector_db(self.input_shape)[1]
+        
+        table = db_info['table']
+        key = db_info['key']
+        
+        # Values of each column, keeping the order of the columns, and of each feature, keeping the order of the features
+        columns = []
+        col_values = {}
+        cats = []
+        cat_values = {}
+        for cat, col, val in values:
+            cat = str(cat)
+            if col not in col_values:
+                columns.append(col)
+                col_values[col] = []
+            col_values[col].append((cat, val))
+            if cat not in cat_values:
+                cats.append(cat)
+                cat_values[cat] = []
+            cat_values[cat].append((col, val))
+        
+        # SQLite: update the table directly, in a single transaction
+        if db_info['driver'] == 'sqlite':
+            # Path of the database, with the GRASS variables replaced
+            database = db_info['database']
+            for var, value in grass.gisenv().items():
+                database = database.replace('$'+var, value)
+            
+            # Features with the same columns are updated by the same statement
+            statements = []
+            params = {}
+            for cat in cats:
+                stmt = 'UPDATE '+table+' SET '+', '.join([col+' = ?' for col, val in cat_values[cat]])+' WHERE '+key+' = ?'
+                if stmt not in params:
+                    statements.append(stmt)
+                    params[stmt] = []
+                params[stmt].append(tuple([_sql_param(val) for col, val in cat_values[cat]]) + (int(cat),))
+            
+            conn = sqlite3.connect(database)
+            try:
+                with conn:
+                    for stmt in statements:
+                        conn.executemany(stmt, params[stmt])
+            finally:
+                conn.close()
+            return
+        
+        # SQL statements, for the other drivers
+        sql = []
+        
+        # DBF does not support CASE, so each feature is updated separately, with all its columns at once
+        if db_info['driver'] == 'dbf':
+            for cat in cats:
+                sets = ', '.join([col+' = '+_sql_value(val) for col, val in cat_values[cat]])
+                sql.append('UPDATE '+table+' SET '+sets+' WHERE '+key+' = '+cat+';')
+        
+        else:
+            for col in columns:
+                rows = [(cat, _sql_value(val)) for cat, val in col_values[col]]
                 
-                # Message - cat ok
-                grass.message("Feature "+str(cat)+' processed with success!')
+                for start in range(0, len(rows), MAX_CASE_ROWS):
+                    batch = rows[start:start + MAX_CASE_ROWS]
+                    cases = ' '.join(['WHEN '+cat+' THEN '+val for cat, val in batch])
+                    batch_cats = ', '.join([cat for cat, val in batch])
+                    sql.append('UPDATE '+table+' SET '+col+' = CASE '+key+' '+cases+' END WHERE '+key+' IN ('+batch_cats+');')
+            
+            # All updates within a single transaction (not supported by DBF)
+            sql = ['BEGIN;'] + sql + ['COMMIT;']
+        
+        # Write all updates to a SQL file and run them at once
+        sql_file = grass.tempfile()
+        try:
+            with open(sql_file, 'w') as f:
+                f.write('\n'.join(sql)+'\n')
+            grass.run_command('db.execute', input = sql_file, database = db_info['database'], driver = db_info['driver'])
+        finally:
+            os.remove(sql_file)
+            
+    # Function _map_features_parallel - run a feature worker over a pool of processes
+    def _map_features_parallel(self, feature_worker, cats):
+        '''
+        Function _map_features_parallel
+        
+        This function runs the worker function for each feature cat in a pool of processes. Each process
+        works within its own temporary mapset, which is removed in the end.
+        
+        Parameters
+        ----------
+        feature_worker: Python function
+            Function that receives a cat and returns any picklable value (e.g. the (results, times) tuple
+            returned by _process_feature).
+        cats: list with strings
+            List with the cats of the features to be processed.
+            
+        Returns
+        -------
+        results: list
+            List with the output of the worker function for each cat, in the same order.
+        '''
+        
+        # Mapsets of the workers are named after the parent process
+        worker_prefix = 'worker_'+str(os.getpid())
+        gisrc_dir = tempfile.mkdtemp()
+        
+        n_workers = min(self.n_workers, len(cats))
+        pool = multiprocessing.Pool(processes = n_workers, initializer = _init_worker, 
+                                    initargs = (self.mapset, worker_prefix, gisrc_dir))
+        try:
+            # Features are sent to the workers in batches
+            results = pool.map(feature_worker, cats, chunksize = self.max_batch_size)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            
+            # Remove the mapsets and session files of the workers
+            env = grass.gisenv()
+            for worker_path in glob.glob(os.path.join(env['GISDBASE'], env['LOCATION_NAME'], worker_prefix+'_*')):
+                shutil.rmtree(worker_path, ignore_errors = True)
+            shutil.rmtree(gisrc_dir, ignore_errors = True)
+        
+        return results
+            
+    # Function run_zonal_stats v2 - run the the function passed as argument for each zone/feature
+    def run_zonal_stats_v2(self, function, select_cats = 'all', *args, **kwargs):
+        '''
+        Function run_zonal_stats
+        
+        This function ...
+        
+        Parameters
+        ----------
+        function: Python function
+            Name of the function to be used to calculate over masks/vetor features.
+        cats: list with integers in character form ('1' and not 1)
+            List with values of lines of the input vector/shape (cats), representing the polygons/features of
+            this vector to be processed. The default is the string 'all', in case all polygons will be processed.
+        *args: several
+            Argument of the function, not named (only value, e.g. 30, 'int')
+        **kwargs: several
+            Optional arguments of the function, named (option = value, e.g. threshold = 50)
+        '''
+        
+        # If the previous steps (load/select maps, create/set columns) were done with success, go on
+        if self.set_cols and self.load_ok:
+            # Get cats of the features to be processed
+            cats = self._get_cats(select_cats)
+            
+            # We can include something to calculate only for selected features and not all
+            
+            # Rasterize all features once; the cells of each feature are selected from it with r.mapcalc
+            zones_rast = self._rasterize_zones()
+            
+            # Bounding boxes of all features (computed once, in __init__), and features sorted in space
+            extents = self.bboxes
+            cats = _sort_cats_spatially(cats, extents)
+            
+            # Raster of interest for the polygon, overwritten for each raster and feature
+            rast_cut = 'temp_rast_input'
+            
+            # For each selected feature
+            results = []
+            try:
+                for cat in cats:
+                    
+                    # Set region to the feature extent, aligned to the raster grid
+                    n, s, e, w = extents[cat]
+                    n, s, e, w = _align_bbox(n, s, e, w, self.grid)
+                    _set_region(n, s, e, w, self.grid)
+                    
+                    # For each raster/column
+                    for i in range(len(self.input_rasters)):
+                        
+                        # Column and raster
+                        col = self.column_names[i]
+                        rast = self.input_rasters[i]
+                        
+                        # Run the equivalent to 'r.mask' for the feature, but with r.mapcalc
+                        expression = rast_cut+' = if('+zones_rast+' == '+cat+', '+rast+', null())'
+                        grass.mapcalc(expression, overwrite = True)
+                        
+                        # Run function
+                        val = function(rast_cut, *args, **kwargs)
+                        
+                        # Keep the value, to be written in the input shape attribute table later
+                        results.append((cat, col, val))
+                    
+                    # Message - cat ok
+                    grass.message("Feature "+str(cat)+' processed with success!')
+            finally:
+                # Restore region
+                _reset_region()
+            
+            # Remove raster of interest and raster of zones
+            grass.run_command('g.remove', flags = 'f', type = 'raster', name = rast_cut, verbose = False)
+            self._remove_zones(zones_rast)
+            
+            # Update values in the input shape attribute table, in a single transaction
+            self._update_values(results)
         
         # If any of the previous moments were not successful, stop.
         else:
@@ -530,6 +2273,126 @@ class GeneralizedZonalStats():
             
             if not self.set_cols:
                 raise Exception('Columns were not set successfully. Please retry.')        
+
+    # Function run_zonal_stats_tiled - compute zonal statistics for all features in a single pass over tiles
+    def run_zonal_stats_tiled(self, method = 'mean', select_cats = 'all', tile_size = 1024):
+        '''
+        Function run_zonal_stats_tiled
+        
+        This function computes simple zonal statistics (sum, count, mean, or proportion) for all features 
+        at once. The input vector is rasterized a single time (use = cat) and the region covering all
+        features is read in tiles; for each tile, the zone and value arrays are read once and the sums and
+        counts of all features are accumulated with np.bincount. Each raster block is therefore read only 
+        once, instead of once for each feature touching it.
+        
+        Parameters
+        ----------
+        method: string; {'sum', 'count', 'mean', 'proportion'}
+            Statistic to be calculated for each feature. 'proportion' is the mean multiplied by 100, and is
+            equivalent to proportion_habitat for binary 1/0 maps.
+        select_cats: list with integers in character form ('1' and not 1)
+            List with values of lines of the input vector/shape (cats), representing the polygons/features of
+            this vector to be processed. The default is the string 'all', in case all polygons will be processed.
+        tile_size: int
+            Number of rows and columns of each tile.
+            
+        Returns
+        -------
+        None.
+        '''
+        
+        # Check method
+        if method not in ['sum', 'count', 'mean', 'proportion']:
+            raise ValueError('Method '+method+' not implemented. Please choose sum, count, mean, or proportion.')
+        
+        # If the previous steps (load/select maps, create/set columns) were done with success, go on
+        if self.set_cols and self.load_ok:
+            # Get cats of the features to be processed
+            cats = self._get_cats(select_cats)
+            
+            # No feature selected, nothing to be computed or updated
+            if not cats:
+                return
+            
+            # Rasterize all features at once, with their cats as values
+            zones_rast = self._rasterize_zones()
+            
+            # Region covering all features, aligned to the first raster
+            grass.use_temp_region()
+            try:
+                grass.run_command('g.region', vector = self.input_shape, align = self.input_rasters[0])
+                region = grass.region()
+                tile_grid = {'proj': region['projection'], 'zone': region['zone'], 'nsres': region['nsres'], 'ewres': region['ewres']}
+                
+                # Sums and counts of each raster, indexed by cat
+                n_zones = max([int(cat) for cat in cats]) + 1
+                sums = np.zeros((len(self.input_rasters), n_zones))
+                counts = np.zeros((len(self.input_rasters), n_zones))
+                
+                # For each tile
+                for row in range(0, region['rows'], tile_size):
+                    for col in range(0, region['cols'], tile_size):
+                        
+                        # Set region to the tile
+                        n = region['n'] - row*region['nsres']
+                        s = region['n'] - min(row + tile_size, region['rows'])*region['nsres']
+                        w = region['w'] + col*region['ewres']
+                        e = region['w'] + min(col + tile_size, region['cols'])*region['ewres']
+                        _set_region(n, s, e, w, tile_grid)
+                        
+                        # Zones of the tile
+                        zones = garray.array(zones_rast, null = 'nan')
+                        in_zone = ~np.isnan(zones)
+                        if not np.any(in_zone):
+                            continue
+                        
+                        # For each raster, accumulate sums and counts of each zone
+                        for i in range(len(self.input_rasters)):
+                            values = garray.array(self.input_rasters[i], null = 'nan')
+                            tile_sums, tile_counts = _zonal_sums_counts(zones, values, n_zones)
+                            sums[i] += tile_sums
+                            counts[i] += tile_counts
+            finally:
+                # Restore region
+                _reset_region()
+                grass.del_temp_region()
+            
+            # Remove raster of zones
+            self._remove_zones(zones_rast)
+            
+            # Statistics for each feature and raster/column
+            results = []
+            for i in range(len(self.input_rasters)):
+                col = self.column_names[i]
+                for cat in cats:
+                    total = sums[i][int(cat)]
+                    count = counts[i][int(cat)]
+                    
+                    if method == 'sum':
+                        val = total
+                    elif method == 'count':
+                        val = int(count)
+                    elif count == 0:
+                        val = None
+                    elif method == 'mean':
+                        val = total/count
+                    else:
+                        val = 100.0*total/count
+                    
+                    results.append((cat, col, val))
+            
+            # Update values in the input shape attribute table, in a single transaction
+            self._update_values(results)
+            
+            grass.message(str(len(cats))+' features processed with success!')
+        
+        # If any of the previous moments were not successful, stop.
+        else:
+            if not self.load_ok:
+                raise Exception('Maps were not loaded successfully. Please retry.')
+            
+            if not self.set_cols:
+                raise Exception('Columns were not set successfully. Please retry.')
     
 
 
@@ -6,7 +6,7 @@
  Laboratorio de Ecologia Espacial e Conservacao
  Universidade Estadual Paulista - UNESP
  Rio Claro - SP - Brasil
- This script runs in GRASS GIS 7.X environment.
+ This script runs in GRASS GIS 7.8+/8.X environment, with Python 3.
 """
 #--------------------------------------------------------------------------------------- 
 
@@ -19,6 +19,7 @@ python
 
 # Import modules
 import os
+import sys
 import grass.script as grass
 import subprocess
 import time
@@ -29,17 +30,38 @@ import time
 
 # Set folder where input files are
 input_dir = r'/home/leecb/Github/GeneralizedZonalStats/input_files_zonal_stats'
-os.chdir(input_dir)
+
+# Re-import maps already present in the mapset? (False = import only the missing ones)
+overwrite_maps = False
+
+# Maps already present in the current mapset (a single g.list call for each type)
+existing_vectors = set(grass.read_command('g.list', type = 'vector', mapset = '.').split())
+existing_rasters = set(grass.read_command('g.list', type = 'raster', mapset = '.').split())
 
 # Import shape file (municipalities of South Brazil)
 shape_name = 'mun_teste_wgs84'
-grass.run_command('v.in.ogr', input = shape_name+'.shp', output = shape_name, overwrite = True)
+if overwrite_maps or shape_name not in existing_vectors:
+    grass.run_command('v.in.ogr', input = os.path.join(input_dir, shape_name+'.shp'), output = shape_name, overwrite = True)
 
 # Import rasters (areas of Eucalyptus plantation in 2001-2004)
 maps = ['BR_2001_euca_9', 'BR_2002_euca_9', 'BR_2003_euca_9', 'BR_2004_euca_9']
 
+# Link the rasters to GRASS (r.external) instead of importing them? In this case, they are read from the
+# GeoTIFF files at each use, so they are first converted to internally tiled COGs (256x256 blocks, with
+# overviews): each feature then reads only the few tiles it covers, instead of whole strips of the map.
+# (when the rasters are imported with r.in.gdal, each file is read only once, so there is no need for that)
+use_external = False
+
 for i in maps:
-    grass.run_command('r.in.gdal', input = i+'.tif', output = i, overwrite = True)
+    if overwrite_maps or i not in existing_rasters:
+        if use_external:
+            cog_file = os.path.join(input_dir, i+'_cog.tif')
+            if not os.path.exists(cog_file):
+                subprocess.check_call(['gdal_translate', '-of', 'COG', '-co', 'BLOCKSIZE=256', '-co', 'COMPRESS=DEFLATE', 
+                                       os.path.join(input_dir, i+'.tif'), cog_file])
+            grass.run_command('r.external', input = cog_file, output = i, overwrite = True)
+        else:
+            grass.run_command('r.in.gdal', input = os.path.join(input_dir, i+'.tif'), output = i, overwrite = True)
 
 
 #------------------
@@ -52,13 +74,28 @@ for i in maps:
 # More info here: https://github.com/LEEClab/LS_METRICS/
 
 # We can leave python, change to LSMetrics script dir and run the LSMetrics script there
-# Or, here, we will call the script from within GRASS
+# Or call the LSMetrics script from within GRASS (it is interactive, so it runs in a new python process,
+# without a shell in between)
 lsmetrics_dir = r'/home/leecb/Github/LS_METRICS/_LSMetrics_v1_0_0'
-os.chdir(lsmetrics_dir)
+#subprocess.call([sys.executable, 'LSMetrics_v1_0_0.py'], cwd=lsmetrics_dir) # runs and wait
 
-# Run LSMetrics
-subprocess.call('python LSMetrics_v1_0_0.py', shell=True) # runs and wait
+# Or, here, we will create the patch ID maps directly, within this session, with r.clump (the same
+# patch ID map as LSMetrics) - no new python process and no interactive prompts
 # Here it is important to decide whether pixels on the diagonal will be considered as the same patch or not!!
+diagonal = False
+
+for i in maps:
+    # Region of the input map (extent and resolution), so the patch ID map is neither clipped nor resampled
+    grass.use_temp_region()
+    try:
+        grass.run_command('g.region', raster = i)
+        # Habitat cells only (non-habitat as null, so that it is not clumped)
+        grass.mapcalc(i+'_habitat = if('+i+' == 1, 1, null())', overwrite = True)
+        # Patch ID
+        grass.run_command('r.clump', input = i+'_habitat', output = i+'_pid', flags = 'd' if diagonal else '', overwrite = True)
+        grass.run_command('g.remove', flags = 'f', type = 'raster', name = i+'_habitat')
+    finally:
+        grass.del_temp_region()
 
 #------------------
 # 4.
@@ -67,12 +104,24 @@ subprocess.call('python LSMetrics_v1_0_0.py', shell=True) # runs and wait
 # We will use the Patch ID map to calculate the number of patches within a shapefile feature (municipality in this example)
 # We will use the binary eucaliptus map to calculate the proportion of eucaliputs within a shapefile feature (municipality in this example)
 
-# Change to the script folder!
+# Add the script folder to the python path!
 script_dir = r'/home/leecb/Github/GeneralizedZonalStats/scripts'
-os.chdir(script_dir)
+sys.path.insert(0, script_dir)
 
 # Import GeneralizedZonalStats class and functions
-from GeneralizedZonalStats_v001 import GeneralizedZonalStats, proportion_habitat, number_patches
+from GeneralizedZonalStats_v001 import GeneralizedZonalStats, proportion_habitat, number_patches, proportion_habitat_stack, proportion_habitat_multi, number_patches_stack
+
+# Number of parallel workers: features are split among workers, each running within its own temporary mapset
+# (None = number of CPUs; 1 = run serially, within the current mapset)
+n_workers = None
+
+# Rasterize the municipalities once, with their cats as values, aligned to the rasters
+# This map of zones is reused by all zonal stats below, instead of rasterizing the vector again in each run
+zone_raster = 'zones_cat'
+grass.use_temp_region()
+grass.run_command('g.region', vector = shape_name, align = maps[0])
+grass.run_command('v.to.rast', input = shape_name, output = zone_raster, use = 'cat', overwrite = True)
+grass.del_temp_region()
 
 #------------------
 # 4.1.
@@ -83,7 +132,7 @@ input_shp = 'mun_teste_wgs84'
 input_rast = ['BR_2001_euca_9']
 
 # Initialize and select maps to be used in zonal stats
-teststats = GeneralizedZonalStats(input_shape = input_shp, input_rasters = input_rast, folder = input_dir)
+teststats = GeneralizedZonalStats(input_shape = input_shp, input_rasters = input_rast, folder = input_dir, n_workers = n_workers, zone_raster = zone_raster)
 
 # Create new cols
 cols = ['p_euc_2001'] # Column name
@@ -94,15 +143,16 @@ col_type = ['float'] # Column type
 # Create cols
 teststats.create_new_column(column_names = cols, type_col=col_type)
 
-# Calculate proportion of eucaliptus in each feature using proportion_habitat function
-teststats.run_zonal_stats(proportion_habitat)
+# Calculate proportion of eucaliptus in all features at once (one r.univar pass over a map of zones)
+# the same as proportion_habitat, for each feature
+#teststats.run_zonal_stats(proportion_habitat)
+teststats.run_zonal_stats_bulk(method = 'proportion')
 
 # Export shapefile
-os.chdir(input_dir)
 # export shape file
-#grass.run_command('v.out.ogr', input = shape_name, output = shape_name+'_prop_euca.shp', overwrite = True)
+#grass.run_command('v.out.ogr', input = shape_name, output = os.path.join(input_dir, shape_name+'_prop_euca.shp'), overwrite = True)
 # export db in csv format
-#grass.run_command('db.out.ogr', input = shape_name, output = shape_name+'_prop_euca.csv')
+#grass.run_command('db.out.ogr', input = shape_name, output = os.path.join(input_dir, shape_name+'_prop_euca.csv'))
 
 #------------------
 # 4.2.
@@ -113,7 +163,7 @@ input_shp = 'mun_teste_wgs84'
 input_rast = ['BR_2001_euca_9', 'BR_2002_euca_9', 'BR_2003_euca_9', 'BR_2004_euca_9']
 
 # Initialize and select maps to be used in zonal stats
-test_prop_euca = GeneralizedZonalStats(input_shape = input_shp, input_rasters = input_rast, folder = input_dir)
+test_prop_euca = GeneralizedZonalStats(input_shape = input_shp, input_rasters = input_rast, folder = input_dir, n_workers = n_workers, zone_raster = zone_raster)
 
 # Create new cols
 #cols = ['p_eu_2001', 'p_eu_2002', 'p_eu_2003', 'p_eu_2004'] # Col name
@@ -127,24 +177,30 @@ col_type = ['float', 'float', 'float', 'float'] # Col type
 test_prop_euca.create_new_column(column_names = cols, type_col=col_type)
 
 # Monitoring time
-start = time.time()
+start = time.perf_counter()
 
-# Calculate proportion of eucalyptus in each feature using proportion_habitat function
+# Calculate proportion of eucalyptus in all features at once (one r.univar pass per raster over a map of zones)
+# the same as proportion_habitat, for each feature
+# The years are run in parallel (up to n_workers r.univar at the same time, in a ParallelModuleQueue), and
+# the attribute table is updated only once, in the end
 #test_prop_euca.run_zonal_stats(proportion_habitat)
-test_prop_euca.run_zonal_stats_v2(proportion_habitat)
+#test_prop_euca.run_zonal_stats_v2(proportion_habitat)
+# or, for each feature, read all years at once as a stack (functions with multi_raster = True)
+#test_prop_euca.run_zonal_stats(proportion_habitat_stack)
+#test_prop_euca.run_zonal_stats(proportion_habitat_multi) # one year in memory at a time
+test_prop_euca.run_zonal_stats_bulk(method = 'proportion')
 
 # Monitoring time
-end = time.time()
+end = time.perf_counter()
 
 # Print total time
-print 'The zonal stats for prop of habitat for 4 years took us '+str((end - start)/60)+' minutes.'
+print(f'The zonal stats for prop of habitat for 4 years took us {(end - start):.3f} s.')
 
 # Export shapefile
-os.chdir(input_dir)
 # export shape file
-#grass.run_command('v.out.ogr', input = shape_name, output = shape_name+'_prop_euca.shp', overwrite = True)
+#grass.run_command('v.out.ogr', input = shape_name, output = os.path.join(input_dir, shape_name+'_prop_euca.shp'), overwrite = True)
 # export db in csv format
-#grass.run_command('db.out.ogr', input = shape_name, output = shape_name+'_prop_euca.csv')
+#grass.run_command('db.out.ogr', input = shape_name, output = os.path.join(input_dir, shape_name+'_prop_euca.csv'))
 
 #------------------
 # 4.3.
@@ -155,7 +211,7 @@ input_shp = 'mun_teste_wgs84'
 input_rast = ['BR_2001_euca_9_pid', 'BR_2002_euca_9_pid', 'BR_2003_euca_9_pid', 'BR_2004_euca_9_pid']
 
 # Initialize and select maps to be used in zonal stats
-test_np = GeneralizedZonalStats(input_shape = input_shp, input_rasters = input_rast, folder = input_dir)
+test_np = GeneralizedZonalStats(input_shape = input_shp, input_rasters = input_rast, folder = input_dir, n_workers = n_workers, zone_raster = zone_raster)
 
 # Create new cols
 cols = ['np_2001', 'np_2002', 'np_2003', 'np_2004'] # Col names
@@ -167,21 +223,23 @@ col_type = ['int', 'int', 'int', 'int'] # Col type
 test_np.create_new_column(column_names = cols, type_col = col_type)
 
 # Monitoring time
-start = time.time()
+start = time.perf_counter()
 
-# Calculate number of patches (clumps) of eucalyptus in each feature using number_patches function
-test_np.run_zonal_stats(number_patches, mask = True)
+# Calculate number of patches (clumps) of eucalyptus in all features at once (one r.stats pass per raster over a map of zones)
+# the same as number_patches, for each feature
+#test_np.run_zonal_stats(number_patches)
+#test_np.run_zonal_stats(number_patches_stack)
+test_np.run_zonal_stats_bulk(method = 'np')
 
 # Monitoring time
-end = time.time()
+end = time.perf_counter()
 
 # Print total time
-print 'The zonal stats for number of patches for 3 years took us '+str((end - start)/60)+' minutes.'
+print(f'The zonal stats for number of patches for 4 years took us {(end - start):.3f} s.')
 
 # Export shapefile
-os.chdir(input_dir)
 # export shape file
-grass.run_command('v.out.ogr', input = shape_name, output = shape_name+'_prop_euca_np.shp', overwrite = True)
+grass.run_command('v.out.ogr', input = shape_name, output = os.path.join(input_dir, shape_name+'_prop_euca_np.shp'), overwrite = True)
 
 #-------------------------------------------------------------------------
 # Do not run below!!!!
@@ -207,20 +265,27 @@ nsres = rast_info['nsres']
 ewres
 nsres
 
-# Create a raster for the feature
-grass.run_command('g.region', vector = input_shape, ewres = ewres, nsres = nsres, align = input_raster)
-grass.run_command('v.to.rast', input = input_shape, output = 'temp_rast', cats = cat, use='val', overwrite = True)
+# Bounding boxes of all features, at once (printed only, the attribute table is not changed)
+bboxes = {}
+for line in grass.read_command('v.to.db', flags = 'p', map = input_shape, option = 'bbox', columns = 'n,s,e,w', separator = 'pipe').splitlines():
+    row = line.split('|')
+    if len(row) == 5 and row[0].isdigit():
+        bboxes[row[0]] = row[1:]
 
-# Set region to the feature
-grass.run_command('g.region', raster = 'temp_rast', zoom = 'temp_rast') 
+# Set region to the feature, from its bounding box, aligned to the raster (no need to rasterize the feature and zoom)
+n, s, e, w = bboxes[cat]
+grass.run_command('g.region', n = n, s = s, e = e, w = w, align = input_raster)
 
-# Run r.mask for the feature
-grass.run_command('r.mask', vector = input_shape, cats = cat)
+# Run r.mask for the feature, from the map of zones rasterized once before 4.1 (zones_cat), so the vector
+# is not rasterized again for each feature; the MASK of the previous feature is just overwritten
+zone_raster = 'zones_cat'
+grass.run_command('r.mask', raster = zone_raster, maskcats = cat, overwrite = True)
 
 prop = proportion_habitat(input_raster)
 
 grass.run_command('v.db.update', map = input_shape, column = col, value = str(prop), where='cat = '+cat)
 
+# Remove the MASK only once, after all features
 grass.run_command('r.mask', flags = 'r')
 
 #---------------
@@ -230,12 +295,13 @@ python
 
 # Import modules
 import os
+import sys
 import grass.script as grass
 
-# Change to the script folder
+# Add the script folder to the python path
 # home/leecb/Github/GeneralizedZonalStats??
 script_dir = r'/home/leecb/Github/GRASS-GIS-Landscape-Metrics/scripts'
-os.chdir(script_dir)
+sys.path.insert(0, script_dir)
 
 # Import GeneralizedZonalStats class
 from GeneralizedZonalStats import GeneralizedZonalStats, proportion_habitat